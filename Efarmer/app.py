@@ -1,25 +1,80 @@
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import (
+    Flask, Blueprint, current_app, render_template, request, redirect, url_for,
+    session, jsonify, send_file, abort,
+)
 import json
 import os
+import threading
+import time
 from datetime import datetime
 from uuid import uuid4
 import math
-import hashlib
+from collections import Counter
+
+import storage
+from image_store import ImageStore, ImageRejected, is_digest, MAX_UPLOAD_BYTES
+from image_meta import read_exif, check_photo_location
+from image_checks import IMAGE_SLOTS, decide_image_status, duplicate_reasons
+from fraud_pipeline import FraudPipeline, build_detectors, entitlement_for
+from models import FarmerRecord, Product
+from linkage import build_linkage
+from case_queue import CaseQueue, STATUSES, score_case
+from backtest import TransactionColumns, backtest, merge_backtests
+from datastore import RuleError, check_rules
+from rollups import (
+    DIMENSIONS, SAVE_EVERY, build_rollups, load_rollups, query_cubes, save_rollups,
+)
+from shards import ShardRouter, district_code
+from velocity import (
+    build_velocity_index, describe_violation,
+    DEFAULT_WINDOWS, VIOLATION_SCORES,
+)
+
+bp = Blueprint("efarmer", __name__)
+
+DEFAULT_CONFIG = {
+    "SECRET_KEY": "demo-secret-key-farm-ai",  # for sessions
+    "DATA_DIR": "data",
+    "UPLOAD_FOLDER": os.path.join("static", "uploads"),
+    "STORAGE_FORMAT": storage.STORAGE_FORMAT,
+    # two photos per request, plus form overhead
+    "MAX_CONTENT_LENGTH": 2 * MAX_UPLOAD_BYTES + 64 * 1024,
+    # warm caches/indexes in a background thread instead of blocking startup
+    "WARM_IN_BACKGROUND": False,
+    # fraud detector worker threads (0 = run detectors inline)
+    "FRAUD_WORKERS": 4,
+    # detector names to enable (None = every registered detector)
+    "FRAUD_DETECTORS": None,
+    # per-EFN purchase limits over sliding windows (see velocity.py)
+    "VELOCITY_WINDOWS": DEFAULT_WINDOWS,
+    # one DataStore per district under DATA_DIR/shards/<CODE>/, routed by
+    # the EFN prefix (see shards.py); off = single data dir
+    "SHARDING": False,
+}
+
+MEDIA_MAX_AGE = 365 * 24 * 3600  # URLs are content hashes, so never stale
+
+def data_store():
+    """Root store: dealers, rules, photo hashes (and everything when unsharded)."""
+    return current_app.extensions["efarmer"]["data"]
+
+
+def shard_router():
+    return current_app.extensions["efarmer"]["router"]
+
 
-app = Flask(__name__)
-app.secret_key = "demo-secret-key-farm-ai"  # for sessions
+def store_for(efn, create=False):
+    """Store of the district shard an EFN belongs to (None if no such shard)."""
+    return shard_router().store_for(efn, create)
 
-DATA_DIR = "data"
-FARMERS_FILE = os.path.join(DATA_DIR, "farmers.json")
-ENTITLE_RULES_FILE = os.path.join(DATA_DIR, "entitlement_rules.json")
-DEALERS_FILE = os.path.join(DATA_DIR, "dealers.json")
-TXNS_FILE = os.path.join(DATA_DIR, "transactions.json")
-FLAGGED_FILE = os.path.join(DATA_DIR, "flagged_cases.json")
-IMAGE_HASHES_FILE = os.path.join(DATA_DIR, "image_hashes.json")
 
-UPLOAD_FOLDER = os.path.join("static", "uploads")
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+def find_farmer(efn):
+    return shard_router().farmer(efn)
+
+
+def image_store():
+    return current_app.extensions["efarmer"]["images"]
+
 
 # ---- Available languages for dropdown ----
 LANGUAGES = [
@@ -95,7 +150,7 @@ def get_lang():
     return session.get("lang", "en")
 
 
-@app.context_processor
+@bp.app_context_processor
 def inject_globals():
     """Make languages, selected language & translation dict available in all templates."""
     code = session.get("lang", "en")
@@ -104,69 +159,224 @@ def inject_globals():
         "languages": LANGUAGES,
         "current_lang": code,
         "t": t,
+        "image_url": image_url,
     }
 
 
-# ---------- JSON helper functions ----------
+def image_url(ref, variant="thumb"):
+    """URL for a farmer photo: store digest (new uploads) or legacy filename."""
+    if not ref:
+        return None
+    if is_digest(ref):
+        return url_for("efarmer.media", digest=ref, variant=variant)
+    return url_for("static", filename=f"uploads/{ref}")
+
+
+# ---------- File helper functions ----------
+# (JSON registry load/save helpers live in storage.py)
+
+def get_image_meta(digest, meta_cache):
+    """EXIF GPS / capture time of a stored photo, cached by content hash."""
+    meta = meta_cache.get(digest)
+    if meta is None:
+        path = image_store().original_path(digest)
+        meta = read_exif(path) if path else {"lat": None, "lon": None, "takenAt": None}
+        data_store().put("image_meta", digest, meta)
+    return meta
+
+
+# ---------- Image verification status ----------
+# (duplicate / GPS rules -> imageStatus live in image_checks.py)
+
+def verify_photo_location(farmer, image_type, digest, meta_cache):
+    meta = get_image_meta(digest, meta_cache)
+    gps = check_photo_location(farmer, meta)
+    gps["takenAt"] = meta.get("takenAt")
+    farmer.setdefault("imageChecks", {}).setdefault(image_type, {})["gps"] = gps
+
+
+def reverify_photo_locations():
+    """
+    Re-run the plot-location check for every farmer's stored photos.
+    EXIF data comes from the hash-keyed cache, so only never-seen photos
+    are read from disk.
+    """
+    meta_cache = data_store().load("image_meta")
+    checked = 0
+    changed_efns = []
+    for store in shard_router().stores().values():
+        for efn, farmer in store.load("farmers").items():
+            before = (farmer.get("imageStatus"), json.dumps(farmer.get("imageChecks"), sort_keys=True))
+            touched = False
+            for field, image_type, _label in IMAGE_SLOTS:
+                digest = farmer.get(field)
+                if is_digest(digest):
+                    verify_photo_location(farmer, image_type, digest, meta_cache)
+                    touched = True
+                    checked += 1
+            if not touched:
+                continue
+            farmer["imageStatus"] = decide_image_status(farmer)
+            after = (farmer.get("imageStatus"), json.dumps(farmer.get("imageChecks"), sort_keys=True))
+            if after != before:
+                store.put("farmers", efn, farmer)
+                changed_efns.append(efn)
+    rescore_farmer_cases(changed_efns)
+    return {"photosChecked": checked, "farmersChanged": len(changed_efns)}
 
-def load_json(path, default):
-    if not os.path.exists(path):
-        return default
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return default
 
+# ---------- Entitlement + Fraud Logic ----------
+
+def farmer_record(efn):
+    """Typed FarmerRecord for an EFN (parsed once, kept current on writes)."""
+    store = store_for(efn)
+    record = store.records("farmers").get(efn) if store else None
+    return record or FarmerRecord.unknown(efn)
 
-def save_json(path, data):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
 
+def get_entitlement_for_farmer(farmer, product="Urea"):
+    """Entitlement in kg for a farmer dict and a product name."""
+    return entitlement_for(farmer_record(farmer["efn"]), Product.parse(product),
+                           data_store().entitlement_index())
 
-def compute_image_hash(path):
-    """Return SHA256 hash of an image file."""
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            h.update(chunk)
-    return h.hexdigest()
 
+def fraud_pipeline():
+    return current_app.extensions["efarmer"]["fraud"]
 
-# ---------- Entitlement + Fraud Logic ----------
 
-def get_entitlement_for_farmer(farmer, product="Urea"):
-    rules = load_json(ENTITLE_RULES_FILE, [])
-    crop = farmer.get("cropType")
-    zone = farmer.get("rainfallZone")
-    land_area = float(farmer.get("landArea", 0) or 0)
+def shared_index(name, build):
+    """In-memory index shared by all requests; built once (normally in warm_app)."""
+    state = current_app.extensions["efarmer"]
+    with state["lock"]:
+        if state["indexes"].get(name) is None:
+            state["indexes"][name] = build()
+    return state["indexes"][name]
+
+
+def velocity_index():
+    """Per-EFN sliding-window index, seeded from transaction history."""
+    return shared_index("velocity", lambda: build_velocity_index(
+        shard_router().records("transactions"), current_app.config["VELOCITY_WINDOWS"]
+    ))
+
+
+def linkage_engine():
+    """Union-find over shared farmer attributes and reused photos."""
+    # ghost farmers are registered across districts, so this spans all shards
+    return shared_index("linkage", lambda: build_linkage(
+        shard_router().farmers(), data_store().load("image_hashes")
+    ))
+
+
+def transaction_columns():
+    """
+    Transactions joined to farmer crop/zone/land, column-wise (for backtests);
+    {shard code: TransactionColumns}.
+    """
+    columns = {}
+    state = current_app.extensions["efarmer"]
+    for code, store in shard_router().stores().items():
+        shard_columns = shared_index(f"txn_columns:{code}", TransactionColumns)
+        # new sales are joined and appended; existing rows are never re-joined.
+        # Under the app lock so two requests do not append the same rows.
+        with state["lock"]:
+            columns[code] = shard_columns.extend(store.records("transactions"),
+                                                 store.records("farmers"))
+    return columns
+
 
-    for rule in rules:
-        if (
-            rule.get("cropType") == crop
-            and rule.get("rainfallZone") == zone
-            and rule.get("productType") == product
-        ):
-            max_per_acre = float(rule.get("maxPerAcre", 0))
-            return land_area * max_per_acre
-    return 0.0
+def rollup_cube(efn):
+    """district x crop x product x month subsidy totals of an EFN's shard, kept current per sale."""
+    store = store_for(efn, create=True)
+    return shared_index(f"rollups:{store.data_dir}", lambda: load_rollups(store))
 
 
-def run_basic_fraud_checks(transaction, farmer):
-    claimed_qty = float(transaction.get("quantity", 0) or 0)
-    product = transaction.get("productType", "Urea")
-    max_allowed = get_entitlement_for_farmer(farmer, product=product)
+def rollup_cubes():
+    """{shard code: RollupCube} for every shard."""
+    return {
+        code: shared_index(f"rollups:{store.data_dir}", lambda: load_rollups(store))
+        for code, store in shard_router().stores().items()
+    }
+
 
-    if max_allowed <= 0:
-        return False, "No entitlement rule defined"
+def case_queue():
+    """Flagged cases indexed by id and ordered by risk, per status."""
+    return shared_index("cases", build_case_queue)
 
-    if claimed_qty > max_allowed:
-        diff = claimed_qty - max_allowed
-        reason = f"Quantity exceeds entitlement by {diff:.1f} units"
-        return True, reason
 
-    return False, "Within entitlement"
+def case_score(case, farmer, dealer_cases, engine):
+    """score_case() for a flagged case from its farmer, dealer and cluster."""
+    return score_case(
+        case, farmer.get("imageStatus"),
+        dealer_cases.get(case.get("dealerId"), 0) - 1,  # other cases of the dealer
+        len(engine.cluster_of(case.get("efn"))) if engine else 1,
+    )
+
+
+def build_case_queue():
+    statuses = data_store().load("case_status")
+    dealer_cases = fraud_pipeline().dealer_flag_counts()
+    engine = linkage_engine()
+
+    def score_shard(store):
+        farmers = store.load("farmers")
+        entries = []
+        for case in store.load("flagged"):
+            farmer = farmers.get(case.get("efn")) or {}
+            risk, components = case_score(case, farmer, dealer_cases, engine)
+            entries.append((case, risk, components, statuses.get(case["caseId"])))
+        return entries
+
+    parts = shard_router().fan_out(score_shard).values()
+    return CaseQueue().load(entry for entries in parts for entry in entries)
+
+
+def built_case_queue(state):
+    """
+    The case queue if it has been built, else None. Waits for a build in
+    progress: it may have read the registries before the caller's change.
+    """
+    queue = state["indexes"].get("cases")
+    if queue is None:
+        with state["lock"]:
+            queue = state["indexes"].get("cases")
+    return queue
+
+
+def queue_new_case(state, case, farmer):
+    """FraudPipeline.on_case hook: score a new case into the queue (worker thread)."""
+    queue = built_case_queue(state)
+    if queue is None:
+        return  # not built yet; it will read the case from the registry
+    risk, components = case_score(case, farmer, state["fraud"].dealer_flag_counts(),
+                                  state["indexes"].get("linkage"))
+    queue.add(case, risk, components)
+
+
+def rescore_farmer_cases(efns):
+    """Re-score the open cases of farmers whose photo status or ghost cluster changed."""
+    state = current_app.extensions["efarmer"]
+    queue = built_case_queue(state)
+    if queue is None:
+        return  # scored from current data when it is built
+    dealer_cases = fraud_pipeline().dealer_flag_counts()
+    engine = linkage_engine()
+    for efn in efns:
+        cases = queue.cases_of(efn)
+        if not cases:
+            continue
+        farmer = find_farmer(efn) or {}
+        for case in cases:
+            queue.rescore(case["caseId"], *case_score(case, farmer, dealer_cases, engine))
+
+
+INDEXES = {
+    "velocity": velocity_index,
+    "linkage": linkage_engine,
+    "txn_columns": transaction_columns,
+    "rollups": rollup_cubes,
+    "cases": case_queue,  # after linkage: scores use cluster membership
+}
 
 
 # ---------- AI-ish eligibility suggestion (rule-based) ----------
@@ -221,26 +431,26 @@ def compute_ai_eligibility(farmer):
 
 # NOTE: per your request, all usernames & passwords are fam1/fam1 (for demo)
 
-@app.route("/")
+@bp.route("/")
 def index():
     get_lang()
     return render_template("base.html")
 
 
-@app.route("/login/admin", methods=["GET", "POST"])
+@bp.route("/login/admin", methods=["GET", "POST"])
 def login_admin():
     get_lang()
     error = None
     if request.method == "POST":
         if request.form.get("username") == "fam1" and request.form.get("password") == "fam1":
             session["role"] = "admin"
-            return redirect(url_for("admin_dashboard"))
+            return redirect(url_for(".admin_dashboard"))
         else:
             error = "Invalid admin credentials"
     return render_template("login.html", role="admin", error=error)
 
 
-@app.route("/login/dealer", methods=["GET", "POST"])
+@bp.route("/login/dealer", methods=["GET", "POST"])
 def login_dealer():
     get_lang()
     error = None
@@ -249,47 +459,44 @@ def login_dealer():
             session["role"] = "dealer"
             # optional: track which dealer they are using
             session["dealer_id"] = request.form.get("dealerId") or "D001"
-            return redirect(url_for("dealer_portal"))
+            return redirect(url_for(".dealer_portal"))
         else:
             error = "Invalid dealer credentials"
-    dealers = load_json(DEALERS_FILE, [])
+    dealers = data_store().load("dealers")
     return render_template("login.html", role="dealer", dealers=dealers, error=error)
 
 
-@app.route("/login/farmer", methods=["GET", "POST"])
+@bp.route("/login/farmer", methods=["GET", "POST"])
 def login_farmer():
     get_lang()
     error = None
     if request.method == "POST":
         efn = request.form.get("efn")
         password = request.form.get("password")
-        farmers = load_json(FARMERS_FILE, {})
-        if password == "fam1" and efn in farmers:
+        if password == "fam1" and find_farmer(efn):
             session["role"] = "farmer"
             session["efn"] = efn
-            return redirect(url_for("farmer_home", efn=efn))
+            return redirect(url_for(".farmer_home", efn=efn))
         else:
             error = "Invalid EFN or password"
     return render_template("login.html", role="farmer", error=error)
 
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     session.clear()
-    return redirect(url_for("index"))
+    return redirect(url_for(".index"))
 
 
 # ---------- FARMER REGISTRATION (ADMIN ONLY) ----------
 
-@app.route("/register-farmer", methods=["GET", "POST"])
+@bp.route("/register-farmer", methods=["GET", "POST"])
 def register_farmer():
     get_lang()
     if session.get("role") != "admin":
-        return redirect(url_for("login_admin"))
+        return redirect(url_for(".login_admin"))
 
     if request.method == "POST":
-        farmers = load_json(FARMERS_FILE, {})
-
         name = request.form.get("farmerName")
         aadhaar = request.form.get("aadhaar")
         ration = request.form.get("rationCard")
@@ -303,8 +510,8 @@ def register_farmer():
         land_lat = request.form.get("landLat") or ""
         land_lon = request.form.get("landLon") or ""
 
-        dist_code = (district or "IND").upper()[:3]
-        efn = f"EFN-{dist_code}-{str(uuid4())[:8].upper()}"
+        # the district code in the EFN also picks the farmer's shard
+        efn = f"EFN-{district_code(district)}-{str(uuid4())[:8].upper()}"
 
         farmer = {
             "efn": efn,
@@ -323,8 +530,12 @@ def register_farmer():
             "imageStatus": "Images Pending"
         }
 
-        farmers[efn] = farmer
-        save_json(FARMERS_FILE, farmers)
+        store_for(efn, create=True).put("farmers", efn, farmer)
+        linkage_engine().add_farmer(farmer)
+        # joining a ghost cluster raises the risk of its members' cases
+        cluster = linkage_engine().cluster_of(efn)
+        if len(cluster) > 1:
+            rescore_farmer_cases(cluster)
 
         return render_template("register_farmer.html", farmer=farmer)
 
@@ -333,12 +544,11 @@ def register_farmer():
 
 # ---------- FARMER PORTAL + IMAGE UPLOAD ----------
 
-@app.route("/farmer/<efn>", methods=["GET"])
+@bp.route("/farmer/<efn>", methods=["GET"])
 def farmer_home(efn):
     get_lang()
     # allow direct view OR via farmer login
-    farmers = load_json(FARMERS_FILE, {})
-    farmer = farmers.get(efn)
+    farmer = find_farmer(efn)
     if not farmer:
         return f"No farmer found for EFN: {efn}", 404
 
@@ -357,93 +567,242 @@ def farmer_home(efn):
     )
 
 
-@app.route("/farmer/<efn>/upload-images", methods=["POST"])
+@bp.route("/farmer/<efn>/upload-images", methods=["POST"])
 def upload_farmer_images(efn):
     get_lang()
-    farmers = load_json(FARMERS_FILE, {})
-    farmer = farmers.get(efn)
-    if not farmer:
+    cached = find_farmer(efn)
+    if not cached:
         return f"No farmer found for EFN: {efn}", 404
 
-    std_img = request.files.get("standardImage")
-    corner_img = request.files.get("cornerImage")
+    # ---- store both photos first; a rejected one leaves the farmer unchanged ----
+    uploads = []
+    try:
+        for field, image_type, label in IMAGE_SLOTS:
+            upload = request.files.get(field)
+            if upload and upload.filename:
+                # content-addressed: identical photos are stored only once
+                h, _created = image_store().ingest(upload)
+                uploads.append((field, image_type, label, h))
+    except ImageRejected as e:
+        return str(e), 400
+
+    # work on copies: the loaded registries are shared with other requests
+    # and only change through put() below
+    farmer = dict(cached)
+    farmer["imageChecks"] = {t: dict(slot) for t, slot in cached.get("imageChecks", {}).items()}
 
     # image_hashes = { hash_value: [ { "efn": "...", "imageType": "standard"/"corner" } ] }
-    image_hashes = load_json(IMAGE_HASHES_FILE, {})
-    suspicious_reasons = []
-
-    # ---- handle standard image ----
-    if std_img and std_img.filename:
-        ext = os.path.splitext(std_img.filename)[1]
-        fname = f"{efn}_base{ext}"
-        path = os.path.join(app.config["UPLOAD_FOLDER"], fname)
-        std_img.save(path)
-        farmer["standardImage"] = fname
+    image_hashes = data_store().load("image_hashes")
+    meta_cache = data_store().load("image_meta")
+    touched_hashes = {}  # hash -> updated usage list
 
-        h = compute_image_hash(path)
-        existing = image_hashes.get(h, [])
+    # ---- handle standard + corner images ----
+    for field, image_type, label, h in uploads:
+        farmer[field] = h
+        existing = touched_hashes.get(h) or list(image_hashes.get(h, []))
 
         # check if this image was used before
-        for entry in existing:
-            if entry["efn"] != efn:
-                suspicious_reasons.append(
-                    f"Standard image reused from EFN {entry['efn']} ({entry['imageType']})"
-                )
-            elif entry["efn"] == efn and entry["imageType"] != "standard":
-                suspicious_reasons.append("Same image used for both standard and corner photos")
-
-        # record this usage
-        existing.append({"efn": efn, "imageType": "standard"})
-        image_hashes[h] = existing
-
-    # ---- handle corner image ----
-    if corner_img and corner_img.filename:
-        ext2 = os.path.splitext(corner_img.filename)[1]
-        fname2 = f"{efn}_corner{ext2}"
-        path2 = os.path.join(app.config["UPLOAD_FOLDER"], fname2)
-        corner_img.save(path2)
-        farmer["cornerImage"] = fname2
-
-        h2 = compute_image_hash(path2)
-        existing2 = image_hashes.get(h2, [])
-
-        for entry in existing2:
-            if entry["efn"] != efn:
-                suspicious_reasons.append(
-                    f"Corner image reused from EFN {entry['efn']} ({entry['imageType']})"
-                )
-            elif entry["efn"] == efn and entry["imageType"] != "corner":
-                suspicious_reasons.append("Same image used for both standard and corner photos")
-
-        existing2.append({"efn": efn, "imageType": "corner"})
-        image_hashes[h2] = existing2
+        farmer["imageChecks"][image_type] = {
+            "duplicates": duplicate_reasons(existing, efn, image_type, label)
+        }
+
+        # record this usage (once per EFN + photo slot)
+        usage = {"efn": efn, "imageType": image_type}
+        if usage not in existing:
+            existing.append(usage)
+            touched_hashes[h] = existing
+
+        # capture GPS must match the registered plot
+        verify_photo_location(farmer, image_type, h, meta_cache)
 
     # decide final status
-    if suspicious_reasons:
-        farmer["imageStatus"] = "Suspicious: " + " | ".join(suspicious_reasons)
-    elif farmer.get("standardImage") and farmer.get("cornerImage"):
-        farmer["imageStatus"] = "Verified (unique images)"
-    else:
-        farmer["imageStatus"] = "Images Pending"
+    farmer["imageStatus"] = decide_image_status(farmer)
+
+    # save back (only the entries this upload touched)
+    store_for(efn).put("farmers", efn, farmer)
+    cluster_before = len(linkage_engine().cluster_of(efn))
+    for h_touched, usages in touched_hashes.items():
+        data_store().put("image_hashes", h_touched, usages)
+        linkage_engine().add_image(h_touched, efn)
+
+    # new photo status; a reused photo may also have grown the ghost cluster
+    cluster = linkage_engine().cluster_of(efn)
+    rescore_farmer_cases(cluster if len(cluster) != cluster_before else [efn])
+
+    return redirect(url_for(".farmer_home", efn=efn))
+
+
+@bp.route("/media/<digest>/<variant>")
+def media(digest, variant):
+    """Serve a stored photo or one of its renditions (thumb / review / original)."""
+    path = image_store().path_for(digest, variant)
+    if not path:
+        abort(404)
+    # conditional=True gives ETag / If-None-Match and Range request support
+    resp = send_file(path, conditional=True, max_age=MEDIA_MAX_AGE)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
+@bp.route("/admin/reverify-gps", methods=["POST"])
+def admin_reverify_gps():
+    if session.get("role") != "admin":
+        return jsonify({"error": "admin login required"}), 401
+    started = datetime.now()
+    result = reverify_photo_locations()
+    result["seconds"] = round((datetime.now() - started).total_seconds(), 3)
+    return jsonify(result)
+
+
+# ---------- DEALER TRANSACTIONS (IDEMPOTENT) ----------
+
+def record_transaction(farmer, item, idempotency_key):
+    """
+    Record one dealer sale unless its idempotency key was already seen.
+    The sale is appended as a delta record and published to the fraud
+    pipeline, so the request never waits on detectors or full-file rewrites.
+    Returns (status, transaction_id, risk_info) where status is
+    "recorded" or "duplicate".
+    """
+    efn = farmer["efn"]
+    store = store_for(efn, create=True)
+    # a sale always routes to its farmer's shard, so keys (and the lock
+    # around check + record) are per district
+    idempotency = store.idempotency
+    with idempotency.lock:
+        # looked up under the lock, so a rollup rebuild cannot swap it out
+        # mid-sale, and before the append so the sale is added once
+        cube = rollup_cube(efn)
+        seen = idempotency.get(idempotency_key)
+        if seen:
+            return "duplicate", seen["transactionId"], seen.get("risk")
+
+        dealer_id = item.get("dealerId")
+        txn_code = f"TXN-{datetime.now().strftime('%Y%m%d')}-{str(uuid4())[:6].upper()}"
+        txn = {
+            "transactionId": txn_code,
+            "efn": efn,
+            "dealerId": dealer_id,
+            "productType": item.get("productType"),
+            "quantity": item.get("quantity"),
+            "unit": item.get("unit"),
+            "date": item.get("date") or datetime.now().strftime("%Y-%m-%d"),
+            "createdAt": item.get("createdAt") or datetime.now().isoformat(),
+            "idempotencyKey": idempotency_key,
+        }
+        # parsed once here: kg quantity, sale time, enum-coded product
+        seq = len(store.records("transactions"))  # position for the pipeline watermark
+        record = store.append("transactions", txn)
+        farmer_rec = farmer_record(efn)
+        cube.add(record, farmer_rec)
+        if cube.covered % SAVE_EVERY == 0:
+            save_rollups(store, cube)
+
+        # velocity is checked at the moment of sale (O(1) amortised per window)
+        violations = velocity_index().observe(efn, record.ts, record.quantity_kg, dealer_id)
+        findings = velocity_findings(violations)
+
+        # remaining detectors run on the fraud pipeline workers, not in this request
+        fraud_pipeline().publish(txn, record, farmer, farmer_rec, findings, store=store, seq=seq)
+        if findings:
+            risk_info = {"status": "Suspicious",
+                         "reason": " | ".join(f["reason"] for f in findings)}
+        else:
+            risk_info = {"status": "Queued", "reason": "Fraud checks running in background"}
+
+        idempotency.remember(idempotency_key, txn_code, risk_info)
+        return "recorded", txn_code, risk_info
+
+
+def velocity_findings(violations):
+    return [
+        {"detector": "velocity", "reason": describe_violation(v),
+         "score": VIOLATION_SCORES[v["metric"]]}
+        for v in violations
+    ]
+
+
+def replay_unchecked_sales():
+    """
+    Re-publish sales that were recorded but not yet checked when the app
+    last stopped (past each store's fraud_progress watermark). Velocity
+    findings are recomputed from the farmer's earlier sales, as they were
+    at the time of sale. Returns the number of sales re-published.
+    """
+    pipeline = fraud_pipeline()
+    windows = current_app.config["VELOCITY_WINDOWS"]
+    replayed = 0
+    for store in shard_router().stores().values():
+        # holds off new sales in this store while the range is taken and queued
+        with store.idempotency.lock:
+            pending = pipeline.unchecked(store)
+            if not pending:
+                continue
+            txns = store.load("transactions")
+            records = store.records("transactions")
+            farmers = store.load("farmers")
+            farmer_recs = store.records("farmers")
+
+            efns = {records[seq].efn for seq in pending}
+            earlier = {efn: [] for efn in efns}
+            for r in records[:pending.start]:
+                if r.efn in earlier:
+                    earlier[r.efn].append(r)
+            indexes = {}
+            for seq in pending:
+                record = records[seq]
+                if record.efn not in farmers:
+                    pipeline.mark_checked(store, seq)
+                    continue
+                index = indexes.get(record.efn)
+                if index is None:
+                    index = indexes[record.efn] = build_velocity_index(
+                        earlier[record.efn], windows, now=record.ts
+                    )
+                violations = index.observe(record.efn, record.ts, record.quantity_kg,
+                                           record.dealer_id)
+                pipeline.publish(txns[seq], record, farmers[record.efn],
+                                 farmer_recs[record.efn], velocity_findings(violations),
+                                 store=store, seq=seq)
+                replayed += 1
+    return replayed
+
+
+SALE_TEXT_FIELDS = ("efn", "dealerId", "productType", "unit", "date", "createdAt")
+
+
+def sale_item_error(item):
+    """Why a sale item cannot be recorded, or None if it is well-formed."""
+    for field in SALE_TEXT_FIELDS:
+        if not isinstance(item.get(field), str):
+            return f"{field} must be a string"
+    quantity = item.get("quantity")
+    if isinstance(quantity, bool):
+        quantity = None
+    try:
+        quantity = float(quantity)
+    except (TypeError, ValueError):
+        return "quantity must be a number"
+    if not (math.isfinite(quantity) and quantity > 0):
+        return "quantity must be a positive number"
+    return None
 
-    # save back
-    farmers[efn] = farmer
-    save_json(FARMERS_FILE, farmers)
-    save_json(IMAGE_HASHES_FILE, image_hashes)
 
-    return redirect(url_for("farmer_home", efn=efn))
+def scoped_idempotency_key(dealer_id, client_key):
+    # keys are generated per terminal, so scope them by dealer
+    return f"{dealer_id}:{client_key}"
 
 
 # ---------- DEALER PORTAL (LOGIN REQUIRED) ----------
 
-@app.route("/dealer", methods=["GET", "POST"])
+@bp.route("/dealer", methods=["GET", "POST"])
 def dealer_portal():
     get_lang()
     if session.get("role") != "dealer":
-        return redirect(url_for("login_dealer"))
+        return redirect(url_for(".login_dealer"))
 
-    dealers = load_json(DEALERS_FILE, [])
-    farmers = load_json(FARMERS_FILE, {})
+    dealers = data_store().load("dealers")
 
     message = None
     txn_code = None
@@ -453,51 +812,30 @@ def dealer_portal():
     if request.method == "POST":
         efn = request.form.get("efn")
         dealer_id = request.form.get("dealerId")
-        product_type = request.form.get("productType")
-        quantity = request.form.get("quantity")
-        unit = request.form.get("unit")
-        date_str = request.form.get("date") or datetime.now().strftime("%Y-%m-%d")
-
-        farmer = farmers.get(efn)
-        if not farmer:
+        # hidden field filled by the page; a resubmitted form reuses it
+        client_key = request.form.get("idempotencyKey") or str(uuid4())
+
+        item = request.form.to_dict()
+        item.setdefault("date", datetime.now().strftime("%Y-%m-%d"))
+        item.setdefault("createdAt", datetime.now().isoformat())
+        error = sale_item_error(item)
+        farmer = find_farmer(efn)
+        if error:
+            message = f"Sale not recorded: {error}"
+        elif not farmer:
             message = f"No farmer found for EFN: {efn}"
         else:
-            txns = load_json(TXNS_FILE, [])
-            txn_code = f"TXN-{datetime.now().strftime('%Y%m%d')}-{str(uuid4())[:6].upper()}"
-            txn = {
-                "transactionId": txn_code,
-                "efn": efn,
-                "dealerId": dealer_id,
-                "productType": product_type,
-                "quantity": quantity,
-                "unit": unit,
-                "date": date_str,
-                "createdAt": datetime.now().isoformat()
-            }
-            txns.append(txn)
-            save_json(TXNS_FILE, txns)
-
-            suspicious, reason = run_basic_fraud_checks(txn, farmer)
-            if suspicious:
-                flagged = load_json(FLAGGED_FILE, [])
-                case_id = f"CASE-{str(uuid4())[:8].upper()}"
-                flagged_case = {
-                    "caseId": case_id,
-                    "transactionId": txn_code,
-                    "efn": efn,
-                    "dealerId": dealer_id,
-                    "reason": reason,
-                    "severity": "High",
-                    "timestamp": datetime.now().isoformat()
-                }
-                flagged.append(flagged_case)
-                save_json(FLAGGED_FILE, flagged)
-
-                risk_info = {"status": "Suspicious", "reason": reason}
+            status, txn_code, risk_info = record_transaction(
+                farmer,
+                item,
+                scoped_idempotency_key(dealer_id, client_key),
+            )
+            if status == "duplicate":
+                message = "Transaction already recorded (duplicate submission ignored)."
+            elif risk_info["status"] == "Suspicious":
                 message = "Transaction recorded but flagged as suspicious."
             else:
-                risk_info = {"status": "OK", "reason": reason}
-                message = "Transaction recorded successfully."
+                message = "Transaction recorded successfully. Fraud checks are running."
 
             farmer_preview = farmer
 
@@ -508,30 +846,232 @@ def dealer_portal():
         txn_code=txn_code,
         risk_info=risk_info,
         farmer_preview=farmer_preview,
+        idempotency_key=str(uuid4()),
+    )
+
+
+@bp.route("/dealer/sync", methods=["POST"])
+def dealer_sync():
+    """
+    Batch upload of sales queued offline on a dealer terminal.
+    Body: {"dealerId": "D001", "items": [{"idempotencyKey": ..., "efn": ...,
+    "productType": ..., "quantity": ..., "unit": ..., "date": ..., "createdAt": ...}]}
+    Every item gets its own acknowledgement; replays are reported as duplicates.
+    """
+    if session.get("role") != "dealer":
+        return jsonify({"error": "dealer login required"}), 401
+
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "body must be a JSON object"}), 400
+    items = payload.get("items")
+    if not isinstance(items, list):
+        return jsonify({"error": "items must be a list"}), 400
+
+    default_dealer = payload.get("dealerId") or session.get("dealer_id")
+    now = datetime.now()
+
+    results = []
+    for item in items:
+        client_key = item.get("idempotencyKey") if isinstance(item, dict) else None
+        if not client_key:
+            results.append({"idempotencyKey": client_key, "status": "rejected",
+                            "error": "missing idempotencyKey"})
+            continue
+        item = dict(item)
+        item["dealerId"] = item.get("dealerId") or default_dealer
+        # terminals may leave the sale time to the server
+        item.setdefault("date", now.strftime("%Y-%m-%d"))
+        item.setdefault("createdAt", now.isoformat())
+        error = sale_item_error(item)
+        if error:
+            results.append({"idempotencyKey": client_key, "status": "rejected",
+                            "error": error})
+            continue
+        farmer = find_farmer(item["efn"])
+        if not farmer:
+            results.append({"idempotencyKey": client_key, "status": "rejected",
+                            "error": f"No farmer found for EFN: {item['efn']}"})
+            continue
+
+        status, txn_code, risk_info = record_transaction(
+            farmer, item,
+            scoped_idempotency_key(item["dealerId"], client_key),
+        )
+        results.append({
+            "idempotencyKey": client_key,
+            "status": status,
+            "transactionId": txn_code,
+            "risk": risk_info,
+        })
+
+    return jsonify({"dealerId": default_dealer, "results": results})
+
+
+@bp.route("/dealer/txn/<txn_id>/risk")
+def dealer_txn_risk(txn_id):
+    """Poll the fraud-check outcome of a recently recorded sale."""
+    if session.get("role") not in ("dealer", "admin"):
+        return jsonify({"error": "login required"}), 401
+    result = fraud_pipeline().status(txn_id)
+    if isinstance(result, dict):
+        return jsonify({"transactionId": txn_id, "status": "Suspicious",
+                        "reason": result["reason"], "severity": result["severity"],
+                        "riskScore": result["riskScore"]})
+    return jsonify({"transactionId": txn_id, "status": result})
+
+
+# ---------- RULE BACKTESTING ----------
+
+@bp.route("/admin/backtest", methods=["POST"])
+def admin_backtest():
+    """
+    Replay a candidate rule set over all past transactions.
+    Body: {"rules": [...]} in entitlement_rules.json format.
+    """
+    if session.get("role") != "admin":
+        return jsonify({"error": "admin login required"}), 401
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "body must be a JSON object"}), 400
+    candidate = payload.get("rules")
+    if not isinstance(candidate, list):
+        return jsonify({"error": "rules must be a list"}), 400
+    try:
+        skipped = check_rules(candidate)
+    except RuleError as e:
+        return jsonify({"error": str(e), "rule": e.index}), 400
+    current = data_store().load("rules")
+    results = shard_router().run_each(
+        lambda columns: backtest(columns, current, candidate), transaction_columns()
     )
+    result = merge_backtests(results.values())
+    result["skippedRules"] = skipped
+    return jsonify(result)
+
+
+# ---------- SUBSIDY ROLLUPS ----------
+
+@bp.route("/admin/rollups")
+def admin_rollups():
+    """
+    Drill-down over the rollup cube, e.g.
+    /admin/rollups?district=raipur&groupBy=productType,month
+    """
+    if session.get("role") != "admin":
+        return jsonify({"error": "admin login required"}), 401
+    filters = {d: request.args[d] for d in DIMENSIONS if request.args.get(d)}
+    group_by = tuple(g for g in request.args.get("groupBy", "district").split(",") if g)
+    try:
+        rows = query_cubes(rollup_cubes().values(), filters, group_by)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"filters": filters, "groupBy": group_by, "rows": rows})
+
+
+@bp.route("/admin/rollups/rebuild", methods=["POST"])
+def admin_rollups_rebuild():
+    if session.get("role") != "admin":
+        return jsonify({"error": "admin login required"}), 401
+    state = current_app.extensions["efarmer"]
+
+    def rebuild(store):
+        # sales are recorded under this lock: none can land between the
+        # build and the swap, i.e. only in the cube being replaced
+        with store.idempotency.lock:
+            cube = build_rollups(store.records("transactions"), store.records("farmers"))
+            save_rollups(store, cube)
+            with state["lock"]:
+                state["indexes"][f"rollups:{store.data_dir}"] = cube
+        return cube
+
+    cubes = shard_router().fan_out(rebuild).values()
+    return jsonify({"cells": sum(len(cube) for cube in cubes),
+                    "transactions": sum(cube.covered for cube in cubes)})
+
+
+# ---------- CASE QUEUE ----------
+
+@bp.route("/admin/cases")
+def admin_cases():
+    """
+    Flagged cases of one status, highest risk first, e.g.
+    /admin/cases?status=open&limit=20&after=<caseId of the last case seen>
+    """
+    if session.get("role") != "admin":
+        return jsonify({"error": "admin login required"}), 401
+    status = request.args.get("status", "open")
+    limit = max(1, min(request.args.get("limit", 20, type=int), 200))
+    try:
+        cases, cursor = case_queue().page(status, limit, request.args.get("after"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except KeyError:
+        return jsonify({"error": "unknown cursor"}), 400
+    return jsonify({"status": status, "cases": cases, "next": cursor,
+                    "counts": case_queue().counts()})
+
+
+@bp.route("/admin/cases/<case_id>", methods=["POST"])
+def admin_case_update(case_id):
+    """Body: {"status": "assigned", "assignee": "officer-7"} (or open / resolved)."""
+    if session.get("role") != "admin":
+        return jsonify({"error": "admin login required"}), 401
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "body must be a JSON object"}), 400
+    status = payload.get("status")
+    if status not in STATUSES:
+        return jsonify({"error": f"status must be one of {', '.join(STATUSES)}"}), 400
+    if status == "assigned" and not payload.get("assignee"):
+        return jsonify({"error": "assignee required"}), 400
+    updated_at = datetime.now().isoformat()
+    try:
+        case = case_queue().transition(case_id, status, payload.get("assignee"), updated_at)
+    except KeyError:
+        return jsonify({"error": f"No case {case_id}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    data_store().put("case_status", case_id, {
+        "status": case["status"], "assignee": case["assignee"], "updatedAt": updated_at,
+    })
+    return jsonify(case)
 
 
 # ---------- ADMIN DASHBOARD (FARMER TABLE + SEARCH) ----------
 
-@app.route("/admin")
+def shard_summary(store):
+    txns = store.records("transactions")
+    return {
+        "farmers": list(store.load("farmers").values()),
+        "flagged": len(store.load("flagged")),
+        "transactions": len(txns),
+        "dealers": Counter(t.dealer_id for t in txns),
+    }
+
+
+@bp.route("/admin")
 def admin_dashboard():
     get_lang()
     if session.get("role") != "admin":
-        return redirect(url_for("login_admin"))
+        return redirect(url_for(".login_admin"))
 
-    farmers = load_json(FARMERS_FILE, {})
-    farmer_list = list(farmers.values())
-    txns = load_json(TXNS_FILE, [])
-    flagged = load_json(FLAGGED_FILE, [])
+    # each shard is summarised in parallel, then merged
+    farmer_list = []
+    total_flagged = total_txns = 0
+    dealer_counts = Counter()
+    for part in shard_router().fan_out(shard_summary).values():
+        farmer_list.extend(part["farmers"])
+        total_flagged += part["flagged"]
+        total_txns += part["transactions"]
+        dealer_counts.update(part["dealers"])
 
-    total_farmers = len(farmers)
-    total_txns = len(txns)
-    total_flagged = len(flagged)
+    total_farmers = len(farmer_list)
+    open_cases, _cursor = case_queue().page("open", limit=50)
 
-    dealer_counts = {}
-    for t in txns:
-        did = t.get("dealerId")
-        dealer_counts[did] = dealer_counts.get(did, 0) + 1
+    ghost_clusters = linkage_engine().clusters(limit=20)
+    subsidy_by_district = query_cubes(rollup_cubes().values(),
+                                      group_by=("district", "productType"))
 
     return render_template(
         "admin.html",
@@ -539,10 +1079,113 @@ def admin_dashboard():
         total_txns=total_txns,
         total_flagged=total_flagged,
         dealer_counts=dealer_counts,
-        flagged_cases=flagged,
+        flagged_cases=open_cases,
+        case_counts=case_queue().counts(),
         farmers=farmer_list,
+        ghost_clusters=ghost_clusters,
+        subsidy_by_district=subsidy_by_district,
     )
 
 
+@bp.route("/admin/ghost-clusters")
+def admin_ghost_clusters():
+    """Ranked suspected ghost clusters; ?rebuild=1 recomputes from the registry."""
+    if session.get("role") != "admin":
+        return jsonify({"error": "admin login required"}), 401
+    if request.args.get("rebuild"):
+        engine = build_linkage(shard_router().farmers(), data_store().load("image_hashes"))
+        state = current_app.extensions["efarmer"]
+        with state["lock"]:
+            state["indexes"]["linkage"] = engine
+            # cluster sizes and photo statuses (e.g. after reverify_images) changed
+            state["indexes"]["cases"] = build_case_queue()
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify({"clusters": linkage_engine().clusters(limit=limit)})
+
+
+# ---------- HEALTH / STARTUP ----------
+
+@bp.route("/healthz")
+def healthz():
+    state = current_app.extensions["efarmer"]
+    return jsonify({
+        "ready": state["ready"].is_set(),
+        "startupSeconds": state["startup_seconds"],
+        "warmTimings": state["warm_timings"],
+        "shards": sorted(code for code in state["router"].stores() if code),
+    })
+
+
+# ---------- APPLICATION FACTORY ----------
+
+def warm_app(app):
+    """Load registries and build lookup indexes before traffic arrives."""
+    state = app.extensions["efarmer"]
+    t0 = time.perf_counter()
+    with app.app_context():
+        timings = state["router"].warm()
+        for name, accessor in INDEXES.items():
+            t1 = time.perf_counter()
+            accessor()
+            timings[name] = time.perf_counter() - t1
+        # sales still queued at the last shutdown
+        t1 = time.perf_counter()
+        replayed = replay_unchecked_sales()
+        timings["fraud_replay"] = time.perf_counter() - t1
+        if replayed:
+            app.logger.info("Re-queued %d unchecked sales for fraud checks", replayed)
+    state["warm_timings"] = {k: round(v, 4) for k, v in timings.items()}
+    state["startup_seconds"] = round(time.perf_counter() - state["created_at"], 4)
+    state["ready"].set()
+    app.logger.info("E-Farmer warm-up done in %.3fs (startup %.3fs)",
+                    time.perf_counter() - t0, state["startup_seconds"])
+
+
+def create_app(config=None):
+    """
+    Build the Flask app. config overrides DEFAULT_CONFIG (DATA_DIR,
+    UPLOAD_FOLDER, WARM_IN_BACKGROUND, SHARDING, ...). Caches are warmed here, so the
+    first requests after a restart do not pay the parsing cost; with
+    WARM_IN_BACKGROUND the app serves (lazily loading) while warming.
+    """
+    created_at = time.perf_counter()
+    # templates sit next to this file
+    app = Flask(__name__, template_folder=".")
+    app.config.update(DEFAULT_CONFIG)
+    if config:
+        app.config.update(config)
+    storage.STORAGE_FORMAT = app.config["STORAGE_FORMAT"]
+
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    router = ShardRouter(app.config["DATA_DIR"], sharded=app.config["SHARDING"])
+    pipeline = FraudPipeline(
+        router,
+        build_detectors(app.config["FRAUD_DETECTORS"]),
+        workers=app.config["FRAUD_WORKERS"],
+    )
+    app.extensions["efarmer"] = state = {
+        "data": router.root,
+        "router": router,
+        "fraud": pipeline,
+        "images": ImageStore(os.path.join(app.config["UPLOAD_FOLDER"], "objects")),
+        "indexes": {},
+        "lock": threading.RLock(),  # index builders may use other indexes
+        "created_at": created_at,
+        "ready": threading.Event(),
+        "startup_seconds": None,
+        "warm_timings": {},
+    }
+    pipeline.on_case = lambda case, farmer: queue_new_case(state, case, farmer)
+    pipeline.start()
+    app.register_blueprint(bp)
+
+    if app.config["WARM_IN_BACKGROUND"]:
+        threading.Thread(target=warm_app, args=(app,), name="efarmer-warmup",
+                         daemon=True).start()
+    else:
+        warm_app(app)
+    return app
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
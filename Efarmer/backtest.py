@@ -0,0 +1,201 @@
+import argparse
+import json
+import threading
+import time
+from array import array
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; the pure-Python pass is used instead
+    np = None
+
+from datastore import DataStore, check_rules, compile_rules
+from models import FarmerRecord
+
+
+# ---------- Rule backtesting over transaction history ----------
+#
+# Transactions are joined to their farmer's crop / zone / land area once and
+# stored column-wise. A rule set then reduces to a small per-key limit table,
+# and evaluating it is a single pass over flat arrays.
+
+class TransactionColumns:
+    def __init__(self):
+        self.keys = []          # code -> (Crop, Zone, Product)
+        self._key_codes = {}
+        self.efns = []          # code -> efn
+        self._efn_codes = {}
+        self.efn = array("i")
+        self.key = array("i")
+        self.land = array("d")
+        self.qty = array("d")
+        # extend() appends while backtests read (numpy holds buffer views)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.qty)
+
+    def _code(self, value, table, lookup):
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(table)
+            table.append(value)
+        return code
+
+    def extend(self, transactions, farmers):
+        """
+        Append rows for TransactionRecords not yet in the columns
+        (farmers: {efn: FarmerRecord}).
+        """
+        with self.lock:
+            for record in transactions[len(self):]:
+                farmer = farmers.get(record.efn) or FarmerRecord.unknown(record.efn)
+                key = (farmer.crop, farmer.zone, record.product)
+                self.key.append(self._code(key, self.keys, self._key_codes))
+                self.efn.append(self._code(record.efn, self.efns, self._efn_codes))
+                self.land.append(farmer.land_area)
+                self.qty.append(record.quantity_kg)
+        return self
+
+    def limits_for(self, rules_index):
+        """maxPerAcre per key code (0 = no rule, never flagged)."""
+        return array("d", (rules_index.get(k, 0.0) for k in self.keys))
+
+    def flags(self, rules_index):
+        """
+        Per-row 0/1: quantity above land x maxPerAcre for that row's key.
+        Like the live entitlement detector, a row whose allowance is not
+        positive (no rule, no land area) is never flagged.
+        """
+        limits = self.limits_for(rules_index)
+        if np is not None and len(self):
+            per_acre = np.frombuffer(limits, dtype=np.float64)[np.frombuffer(self.key, dtype=np.int32)]
+            land = np.frombuffer(self.land, dtype=np.float64)
+            qty = np.frombuffer(self.qty, dtype=np.float64)
+            allowed = land * per_acre
+            return ((allowed > 0) & (qty > allowed)).astype(np.uint8).tobytes()
+        return bytes(
+            1 if (allowed := a * limits[k]) > 0 and q > allowed else 0
+            for k, a, q in zip(self.key, self.land, self.qty)
+        )
+
+
+def _diff(columns, before, after):
+    """Per-key counts of newly / no-longer flagged rows, and flagged farmer sets."""
+    if np is not None and len(columns):
+        b = np.frombuffer(before, dtype=np.uint8).astype(bool)
+        a = np.frombuffer(after, dtype=np.uint8).astype(bool)
+        keys = np.frombuffer(columns.key, dtype=np.int32)
+        efns = np.frombuffer(columns.efn, dtype=np.int32)
+        n_keys = len(columns.keys)
+        newly = np.bincount(keys[a & ~b], minlength=n_keys).tolist()
+        cleared = np.bincount(keys[b & ~a], minlength=n_keys).tolist()
+        return (
+            Counter({k: n for k, n in enumerate(newly) if n}),
+            Counter({k: n for k, n in enumerate(cleared) if n}),
+            set(np.unique(efns[b]).tolist()),
+            set(np.unique(efns[a]).tolist()),
+        )
+
+    newly, cleared = Counter(), Counter()
+    farmers_before, farmers_after = set(), set()
+    for i, (b, a) in enumerate(zip(before, after)):
+        if b:
+            farmers_before.add(columns.efn[i])
+        if a:
+            farmers_after.add(columns.efn[i])
+        if a and not b:
+            newly[columns.key[i]] += 1
+        elif b and not a:
+            cleared[columns.key[i]] += 1
+    return newly, cleared, farmers_before, farmers_after
+
+
+def backtest(columns, current_rules, candidate_rules):
+    """
+    Compare which historical transactions each rule set would flag.
+    candidate_rules must pass datastore.check_rules.
+    """
+    t0 = time.perf_counter()
+    with columns.lock:
+        before = columns.flags(compile_rules(current_rules))
+        after = columns.flags(compile_rules(candidate_rules))
+
+        newly, cleared, farmers_before, farmers_after = _diff(columns, before, after)
+        keys = list(columns.keys)
+
+    def by_key(counter):
+        return [
+            {"cropType": keys[k][0].value, "rainfallZone": keys[k][1].value,
+             "productType": keys[k][2].value, "transactions": n}
+            for k, n in counter.most_common()
+        ]
+
+    return {
+        "transactions": len(before),
+        "flaggedCurrent": sum(before),
+        "flaggedCandidate": sum(after),
+        "newlyFlagged": sum(newly.values()),
+        "noLongerFlagged": sum(cleared.values()),
+        "farmersFlaggedCurrent": len(farmers_before),
+        "farmersFlaggedCandidate": len(farmers_after),
+        "farmersNewlyFlagged": len(farmers_after - farmers_before),
+        "newlyFlaggedByRule": by_key(newly),
+        "noLongerFlaggedByRule": by_key(cleared),
+        "seconds": round(time.perf_counter() - t0, 4),
+    }
+
+
+def merge_backtests(results):
+    """
+    Combine backtest() results of district shards. Farmers live in exactly
+    one shard, so farmer counts add up like transaction counts.
+    """
+    results = list(results)
+    merged = {}
+    for field in ("transactions", "flaggedCurrent", "flaggedCandidate", "newlyFlagged",
+                  "noLongerFlagged", "farmersFlaggedCurrent", "farmersFlaggedCandidate",
+                  "farmersNewlyFlagged"):
+        merged[field] = sum(r[field] for r in results)
+    for field in ("newlyFlaggedByRule", "noLongerFlaggedByRule"):
+        totals = Counter()
+        for r in results:
+            for row in r[field]:
+                totals[(row["cropType"], row["rainfallZone"], row["productType"])] += row["transactions"]
+        merged[field] = [
+            {"cropType": c, "rainfallZone": z, "productType": p, "transactions": n}
+            for (c, z, p), n in totals.most_common()
+        ]
+    merged["seconds"] = max((r["seconds"] for r in results), default=0.0)
+    return merged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a candidate entitlement rule set over all past transactions."
+    )
+    parser.add_argument("candidate", help="JSON file in entitlement_rules.json format")
+    parser.add_argument("--data-dir", default="data")
+    args = parser.parse_args(argv)
+
+    store = DataStore(args.data_dir)
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+    if not isinstance(candidate, list):
+        parser.error("candidate must be a JSON list of rules")
+    try:
+        skipped = check_rules(candidate)
+    except ValueError as e:
+        parser.error(str(e))
+    t0 = time.perf_counter()
+    columns = TransactionColumns().extend(store.records("transactions"), store.records("farmers"))
+    load_seconds = time.perf_counter() - t0
+    result = backtest(columns, store.load("rules"), candidate)
+    result["skippedRules"] = skipped
+    result["loadSeconds"] = round(load_seconds, 4)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import math
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+from fraud_pipeline import combine_scores, severity_for
+
+
+# ---------- Flagged-case work queue ----------
+#
+# Every flagged case gets a numeric risk score from four signals: how far
+# the sale went over entitlement, the dealer's flagged history, whether
+# the farmer sits in a ghost cluster, and the farmer's photo status (other
+# detector findings, e.g. velocity, are kept as a fifth component).
+# Components are 0-100 and combined noisy-OR, like the pipeline's riskScore.
+#
+# Cases are indexed by caseId and kept in one SortedKeys per status,
+# ordered by (-risk, flagged time, caseId). Adding a case or changing its
+# status costs a couple of bisects plus a short chunk insert, and pages
+# resume from a caseId cursor, so officers working the queue concurrently
+# do not skip or repeat cases.
+#
+# A farmer's unresolved cases are re-scored (rescore) when their photo
+# status or ghost cluster changes. The dealer-history component is the
+# count when the case was last scored; it is not refreshed as the dealer
+# collects further cases.
+
+STATUSES = ("open", "assigned", "resolved")
+
+TRANSITIONS = {
+    "open": {"assigned", "resolved"},
+    "assigned": {"open", "resolved"},   # unassign, or close
+    "resolved": {"open"},               # reopen
+}
+
+
+def dealer_history_score(prior_cases):
+    """0 for a clean dealer, rising with flagged cases (60 at 16+)."""
+    if prior_cases <= 0:
+        return 0.0
+    return min(60.0, 15.0 * math.log2(1 + prior_cases))
+
+
+def cluster_score(cluster_size):
+    """0 for a lone farmer; 40 for a pair, up to 90 for large clusters."""
+    if cluster_size < 2:
+        return 0.0
+    return min(90.0, 40.0 + 12.5 * math.log2(cluster_size / 2))
+
+
+def image_status_score(image_status):
+    status = image_status or ""
+    if status.startswith("Suspicious"):
+        return 50.0
+    if status.startswith("Images Pending"):
+        return 15.0
+    if "GPS not verified" in status:
+        return 5.0
+    return 0.0
+
+
+def score_case(case, image_status, dealer_cases, cluster_size):
+    """Risk 0-100 for a flagged case and its components."""
+    by_detector = {}
+    for f in case.get("findings") or ():
+        by_detector.setdefault(f.get("detector"), []).append(f.get("score", 0))
+    components = {
+        "entitlement": max(by_detector.pop("entitlement", [0])),
+        "dealer": max(max(by_detector.pop("dealer", [0])), dealer_history_score(dealer_cases)),
+        "cluster": cluster_score(cluster_size),
+        "image": max(max(by_detector.pop("image", [0])), image_status_score(image_status)),
+        "other": combine_scores(s for scores in by_detector.values() for s in scores),
+    }
+    if not case.get("findings"):
+        # cases flagged before findings were recorded only carry a score
+        components["other"] = max(components["other"], case.get("riskScore") or 0)
+    components = {k: round(v, 1) for k, v in components.items()}
+    return combine_scores(components.values()), components
+
+
+class SortedKeys:
+    """
+    Sorted list kept as chunks of up to 2 x CHUNK keys, so an insert or
+    delete shifts one chunk instead of the whole list.
+    """
+
+    CHUNK = 1000
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._chunks = [keys[i:i + self.CHUNK] for i in range(0, len(keys), self.CHUNK)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+        else:
+            i = min(bisect_left(self._maxes, key), len(self._chunks) - 1)
+            chunk = self._chunks[i]
+            insort(chunk, key)
+            self._maxes[i] = chunk[-1]
+            if len(chunk) > 2 * self.CHUNK:
+                half = chunk[self.CHUNK:]
+                del chunk[self.CHUNK:]
+                self._chunks.insert(i + 1, half)
+                self._maxes[i] = chunk[-1]
+                self._maxes.insert(i + 1, half[-1])
+        self._len += 1
+
+    def remove(self, key):
+        i = bisect_left(self._maxes, key)
+        chunk = self._chunks[i] if i < len(self._chunks) else []
+        j = bisect_left(chunk, key)
+        if j == len(chunk) or chunk[j] != key:
+            raise KeyError(key)
+        del chunk[j]
+        if chunk:
+            self._maxes[i] = chunk[-1]
+        else:
+            del self._chunks[i]
+            del self._maxes[i]
+        self._len -= 1
+
+    def after(self, key=None, limit=20):
+        """Up to `limit` keys greater than key (from the start if None), and whether more follow."""
+        if key is None:
+            i = j = 0
+        else:
+            i = bisect_right(self._maxes, key)
+            j = bisect_right(self._chunks[i], key) if i < len(self._chunks) else 0
+        out = []
+        while i < len(self._chunks) and len(out) < limit:
+            chunk = self._chunks[i]
+            taken = chunk[j:j + limit - len(out)]
+            out.extend(taken)
+            j += len(taken)
+            if j >= len(chunk):
+                i, j = i + 1, 0
+        return out, i < len(self._chunks)
+
+
+class CaseQueue:
+    def __init__(self):
+        self._entries = {}  # caseId -> entry
+        self._by_efn = {}   # efn -> {caseId}
+        self._order = {status: SortedKeys() for status in STATUSES}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, case_id):
+        return case_id in self._entries
+
+    @staticmethod
+    def _sort_key(case, risk):
+        return (-risk, case.get("timestamp") or "", case["caseId"])
+
+    def add(self, case, risk, components, status="open", assignee=None, updated_at=None):
+        """Index a case; a caseId already in the queue is ignored."""
+        with self._lock:
+            if case["caseId"] in self._entries:
+                return False
+            key = self._sort_key(case, risk)
+            self._entries[case["caseId"]] = {
+                "case": case, "risk": risk, "components": components, "key": key,
+                "status": status, "assignee": assignee, "updatedAt": updated_at,
+            }
+            self._order[status].add(key)
+            self._by_efn.setdefault(case.get("efn"), set()).add(case["caseId"])
+            return True
+
+    def load(self, entries):
+        """Bulk add of (case, risk, components, status record) - one sort per status."""
+        with self._lock:
+            pending = {status: [] for status in STATUSES}
+            for case, risk, components, state in entries:
+                if case["caseId"] in self._entries:
+                    continue
+                state = state or {}
+                status = state.get("status") if state.get("status") in STATUSES else "open"
+                key = self._sort_key(case, risk)
+                self._entries[case["caseId"]] = {
+                    "case": case, "risk": risk, "components": components, "key": key,
+                    "status": status, "assignee": state.get("assignee"),
+                    "updatedAt": state.get("updatedAt"),
+                }
+                pending[status].append(key)
+                self._by_efn.setdefault(case.get("efn"), set()).add(case["caseId"])
+            for status, keys in pending.items():
+                if len(self._order[status]):
+                    for key in keys:
+                        self._order[status].add(key)
+                else:
+                    self._order[status] = SortedKeys(keys)
+        return self
+
+    def _view(self, entry):
+        return dict(
+            entry["case"],
+            queueRisk=entry["risk"],
+            queueSeverity=severity_for(entry["risk"]),
+            riskComponents=entry["components"],
+            status=entry["status"],
+            assignee=entry["assignee"],
+            updatedAt=entry["updatedAt"],
+        )
+
+    def get(self, case_id):
+        with self._lock:
+            entry = self._entries.get(case_id)
+            return self._view(entry) if entry else None
+
+    def page(self, status="open", limit=20, after=None):
+        """
+        Next `limit` cases of a status, highest risk first, starting after the
+        caseId `after`. Returns (cases, cursor for the next page or None).
+        """
+        if status not in STATUSES:
+            raise ValueError(f"Unknown status: {status}")
+        with self._lock:
+            start = None
+            if after:
+                entry = self._entries.get(after)
+                if entry is None:
+                    raise KeyError(after)
+                start = entry["key"]
+            keys, more = self._order[status].after(start, limit)
+            cases = [self._view(self._entries[key[2]]) for key in keys]
+        return cases, (keys[-1][2] if keys and more else None)
+
+    def transition(self, case_id, status, assignee=None, updated_at=None):
+        """Move a case to another status; raises KeyError / ValueError."""
+        with self._lock:
+            entry = self._entries.get(case_id)
+            if entry is None:
+                raise KeyError(case_id)
+            if status not in TRANSITIONS.get(entry["status"], ()):
+                raise ValueError(f"Cannot move a case from {entry['status']} to {status}")
+            if status == "assigned" and not assignee:
+                raise ValueError("assignee required")
+            self._order[entry["status"]].remove(entry["key"])
+            self._order[status].add(entry["key"])
+            entry["status"] = status
+            if status == "open":
+                entry["assignee"] = None
+            elif assignee:
+                entry["assignee"] = assignee  # resolved keeps the officer who had it
+            entry["updatedAt"] = updated_at
+            return self._view(entry)
+
+    def cases_of(self, efn):
+        """A farmer's cases that are still open or assigned."""
+        with self._lock:
+            return [self._entries[case_id]["case"] for case_id in self._by_efn.get(efn, ())
+                    if self._entries[case_id]["status"] != "resolved"]
+
+    def rescore(self, case_id, risk, components):
+        """Replace a case's risk score and move it to its new position."""
+        with self._lock:
+            entry = self._entries.get(case_id)
+            if entry is None:
+                return False
+            key = self._sort_key(entry["case"], risk)
+            if key != entry["key"]:
+                order = self._order[entry["status"]]
+                order.remove(entry["key"])
+                order.add(key)
+            entry.update(risk=risk, components=components, key=key)
+            return True
+
+    def counts(self):
+        with self._lock:
+            return {status: len(keys) for status, keys in self._order.items()}
@@ -0,0 +1,224 @@
+import os
+import threading
+import time
+
+import storage
+from idempotency import IdempotencyStore
+from models import RECORD_TYPES, Crop, Zone, Product
+
+
+# ---------- Data store: registry files + in-memory caches ----------
+#
+# One DataStore per data directory. Registries are parsed once and kept in
+# memory; writes go through the store so the cached copy stays current
+# without re-reading the file. If a file is changed by another process its
+# stamp (storage.stamp) no longer matches and it is reloaded on next access.
+#
+# Registries in RECORD_TYPES are also available as typed records
+# (records()). Transactions are only kept as records: the raw dicts are
+# parsed, converted and dropped.
+
+REGISTRIES = {
+    # name: (file name, empty value)
+    "farmers": ("farmers.json", {}),
+    "dealers": ("dealers.json", []),
+    "rules": ("entitlement_rules.json", []),
+    "transactions": ("transactions.json", []),
+    "flagged": ("flagged_cases.json", []),
+    "image_hashes": ("image_hashes.json", {}),
+    "image_meta": ("image_meta.json", {}),
+    "rollups": ("rollups.json", {}),
+    "case_status": ("case_status.json", {}),
+    "fraud_progress": ("fraud_progress.json", {}),
+}
+
+RECORDS_ONLY = {"transactions"}
+
+
+class DataStore:
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.idempotency = IdempotencyStore(os.path.join(data_dir, "idempotency_keys.log"))
+        self._lock = threading.RLock()
+        self._cache = {}  # name -> (stamp, data)
+        self._records = {}  # name -> (stamp, records)
+        self._derived = {}  # name -> (source stamp, value)
+
+    def path(self, name):
+        return os.path.join(self.data_dir, REGISTRIES[name][0])
+
+    def _stamp(self, name):
+        return storage.stamp(self.path(name))
+
+    def _empty(self, name):
+        empty = REGISTRIES[name][1]
+        return type(empty)()
+
+    def load(self, name):
+        """
+        Contents of a registry. Cached (shared object - write via put/append),
+        except for RECORDS_ONLY registries which are parsed fresh each call.
+        """
+        with self._lock:
+            stamp = self._stamp(name)
+            cached = self._cache.get(name)
+            if cached and cached[0] == stamp:
+                return cached[1]
+            data = storage.load_json(self.path(name), self._empty(name))
+            if name not in RECORDS_ONLY:
+                self._cache[name] = (stamp, data)
+            return data
+
+    def records(self, name):
+        """
+        Typed records of a registry: {key: record} for dict registries,
+        [record, ...] for list registries.
+        """
+        with self._lock:
+            stamp = self._stamp(name)
+            cached = self._records.get(name)
+            if cached and cached[0] == stamp:
+                return cached[1]
+            make = RECORD_TYPES[name].from_dict
+            data = self.load(name)
+            if isinstance(data, dict):
+                records = {k: make(v) for k, v in data.items()}
+            else:
+                records = [make(v) for v in data]
+            self._records[name] = (self._stamp(name), records)
+            return records
+
+    def _drop_stale(self, name):
+        # changed by someone else since we cached it: reload on next access
+        stamp = self._stamp(name)
+        for cache in (self._cache, self._records):
+            if name in cache and cache[name][0] != stamp:
+                del cache[name]
+
+    def _after_write(self, name, apply_raw, apply_records):
+        stamp = self._stamp(name)
+        if name in self._cache:
+            apply_raw(self._cache[name][1])
+            self._cache[name] = (stamp, self._cache[name][1])
+        if name in self._records:
+            apply_records(self._records[name][1])
+            self._records[name] = (stamp, self._records[name][1])
+
+    def put(self, name, key, value):
+        record_type = RECORD_TYPES.get(name)
+        record = record_type.from_dict(value) if record_type else None
+        with self._lock:
+            self._drop_stale(name)
+            storage.put_record(self.path(name), key, value)
+            self._after_write(
+                name,
+                lambda data: data.__setitem__(key, value),
+                lambda recs: recs.__setitem__(key, record),
+            )
+
+    def append(self, name, value):
+        """Append to a list registry; returns the typed record if it has one."""
+        # parsed before it is written, so a value that cannot be parsed
+        # never reaches the file
+        record_type = RECORD_TYPES.get(name)
+        record = record_type.from_dict(value) if record_type else None
+        with self._lock:
+            self._drop_stale(name)
+            storage.append_record(self.path(name), value)
+            self._after_write(
+                name,
+                lambda data: data.append(value),
+                lambda recs: recs.append(record),
+            )
+            return record
+
+    def save(self, name, data):
+        with self._lock:
+            storage.save_json(self.path(name), data)
+            self._records.pop(name, None)
+            if name not in RECORDS_ONLY:
+                self._cache[name] = (self._stamp(name), data)
+
+    # ---- derived lookups ----
+
+    def derived(self, name, source, build):
+        """Value computed from a registry, rebuilt only when that registry changes."""
+        with self._lock:
+            data = self.load(source)
+            stamp = self._cache[source][0]
+            cached = self._derived.get(name)
+            if cached and cached[0] == stamp:
+                return cached[1]
+            value = build(data)
+            self._derived[name] = (stamp, value)
+            return value
+
+    def entitlement_index(self):
+        """{(Crop, Zone, Product): maxPerAcre} compiled from the rules."""
+        return self.derived("entitlement_index", "rules", compile_rules)
+
+    # ---- startup ----
+
+    def warm(self, names=None):
+        """Parse registries (all by default) and build lookups up front. Returns per-step seconds."""
+        timings = {}
+        for name in names or REGISTRIES:
+            t0 = time.perf_counter()
+            if name in RECORD_TYPES:
+                self.records(name)
+            else:
+                self.load(name)
+            timings[name] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        self.entitlement_index()
+        self.idempotency.get("")  # loads the seen-keys log
+        timings["indexes"] = time.perf_counter() - t0
+        return timings
+
+
+RULE_FIELDS = (("cropType", Crop), ("rainfallZone", Zone), ("productType", Product))
+
+
+class RuleError(ValueError):
+    """A rule that cannot be compiled; index is its position in the list."""
+
+    def __init__(self, index, message):
+        super().__init__(f"rule {index}: {message}")
+        self.index = index
+
+
+def check_rules(rules):
+    """
+    Validate a rule list (e.g. a backtest candidate) before compiling it.
+    Raises RuleError for a malformed rule; returns the rules compile_rules
+    would skip, as [{"index", "rule", "reason"}].
+    """
+    skipped = []
+    for i, rule in enumerate(rules):
+        if not isinstance(rule, dict):
+            raise RuleError(i, "must be an object")
+        limit = rule.get("maxPerAcre", 0)
+        if isinstance(limit, bool) or not isinstance(limit, (int, float)) or limit != limit:
+            raise RuleError(i, "maxPerAcre must be a number")
+        unknown = []
+        for field, enum in RULE_FIELDS:
+            value = rule.get(field)
+            if value is not None and not isinstance(value, str):
+                raise RuleError(i, f"{field} must be a string")
+            if enum.parse(value) is enum.OTHER:
+                unknown.append(f"unknown {field} {value!r}")
+        if unknown:
+            skipped.append({"index": i, "rule": rule, "reason": ", ".join(unknown)})
+    return skipped
+
+
+def compile_rules(rules):
+    index = {}
+    for rule in rules:
+        key = tuple(enum.parse(rule.get(field)) for field, enum in RULE_FIELDS)
+        if Crop.OTHER in key or Zone.OTHER in key or Product.OTHER in key:
+            continue  # rule for a value the data model does not know
+        # first matching rule wins, as in the original linear scan
+        index.setdefault(key, float(rule.get("maxPerAcre", 0)))
+    return index
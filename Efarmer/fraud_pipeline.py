@@ -0,0 +1,319 @@
+import logging
+import queue
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+from uuid import uuid4
+
+log = logging.getLogger(__name__)
+
+
+# ---------- Entitlement rule ----------
+
+def entitlement_for(farmer, product, rules_index):
+    """
+    Max kg allowed = land area x per-acre limit for (crop, zone, product).
+    farmer is a FarmerRecord, product a models.Product.
+    """
+    max_per_acre = rules_index.get((farmer.crop, farmer.zone, product))
+    if max_per_acre is None:
+        return 0.0
+    return farmer.land_area * max_per_acre
+
+
+# ---------- Detectors ----------
+#
+# A detector looks at one transaction event and returns findings:
+#   {"detector": name, "reason": str, "score": 0-100}
+# `requires` lists the state it reads (root DataStore registry names, or
+# "entitlement_index"); the pipeline hands exactly that to inspect().
+
+DETECTORS = {}
+
+
+def register_detector(cls):
+    DETECTORS[cls.name] = cls
+    return cls
+
+
+class Detector:
+    name = "base"
+    requires = ()
+
+    def inspect(self, event, state):
+        raise NotImplementedError
+
+    def finding(self, reason, score):
+        return {"detector": self.name, "reason": reason, "score": score}
+
+
+@register_detector
+class EntitlementDetector(Detector):
+    name = "entitlement"
+    requires = ("entitlement_index",)
+
+    def inspect(self, event, state):
+        record = event["record"]
+        max_allowed = entitlement_for(event["farmer_record"], record.product,
+                                      state["entitlement_index"])
+        if max_allowed <= 0 or record.quantity_kg <= max_allowed:
+            return []
+        diff = record.quantity_kg - max_allowed
+        # 50 at the limit, 100 once the claim is double the entitlement
+        score = 50 + min(50, 50 * diff / max_allowed)
+        return [self.finding(f"Quantity exceeds entitlement by {diff:.1f} kg", score)]
+
+
+@register_detector
+class DealerDetector(Detector):
+    name = "dealer"
+    requires = ("dealers", "flagged")
+    repeat_offender_cases = 5
+
+    def inspect(self, event, state):
+        dealer_id = event["record"].dealer_id
+        findings = []
+        if dealer_id not in {d.get("dealerId") for d in state["dealers"]}:
+            findings.append(self.finding(f"Unknown dealer {dealer_id}", 60))
+        prior = state["dealer_flag_counts"].get(dealer_id, 0)
+        if prior >= self.repeat_offender_cases:
+            findings.append(self.finding(
+                f"Dealer {dealer_id} already has {prior} flagged cases", min(60, 20 + 4 * prior)
+            ))
+        return findings
+
+
+@register_detector
+class ImageDetector(Detector):
+    name = "image"
+    requires = ()
+
+    def inspect(self, event, state):
+        status = event["farmer"].get("imageStatus") or ""
+        if status.startswith("Suspicious"):
+            return [self.finding(f"Farmer land photos flagged ({status})", 40)]
+        return []
+
+
+# ---------- Pipeline ----------
+
+def combine_scores(scores):
+    """Noisy-OR: independent signals reinforce each other but stay below 100."""
+    remaining = 1.0
+    for s in scores:
+        remaining *= 1 - min(max(s, 0), 100) / 100
+    return round(100 * (1 - remaining), 1)
+
+
+def severity_for(score):
+    if score >= 70:
+        return "High"
+    if score >= 40:
+        return "Medium"
+    return "Low"
+
+
+class FraudPipeline:
+    """
+    Transactions are published to an in-process queue and checked by a pool
+    of worker threads, so the dealer request only pays for an enqueue.
+    With workers=0 events are processed inline (scripts, tests).
+    Cases are written to the flagged registry of the farmer's district shard
+    (router: shards.ShardRouter); dealers and rules come from the root store.
+
+    Workers are threads: they take the checks off the request and overlap
+    registry writes, but pure-Python detectors share one core under the
+    GIL, so extra workers add little throughput once checks are CPU-bound.
+
+    Sales published with their store and position (seq) in its transactions
+    list advance a per-store watermark (fraud_progress registry) as they
+    are checked; unchecked() tells the app what to re-publish after a
+    restart, so queued events are not lost.
+    """
+
+    RESULT_CACHE_SIZE = 10000
+
+    def __init__(self, router, detectors, workers=2):
+        self.router = router
+        self.detectors = list(detectors)
+        self.workers = workers
+        self.queue = queue.Queue()
+        self.results = OrderedDict()  # transactionId -> case or None (recent only)
+        self._results_lock = threading.Lock()
+        self._threads = []
+        self._dealer_flag_counts = None  # seeded from flagged_cases on first use
+        self.on_case = None  # called as on_case(case, farmer) for each new case
+        self._progress = {}  # store data dir -> checked watermark + out-of-order seqs
+        self._progress_lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"fraud-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def publish(self, transaction, record, farmer, farmer_record, findings=(),
+                store=None, seq=None):
+        """
+        Queue a recorded sale (raw dict + TransactionRecord, farmer dict +
+        FarmerRecord); findings computed upstream are merged in. store/seq
+        locate the sale in its transactions registry for the watermark.
+        """
+        event = {
+            "transaction": dict(transaction),
+            "record": record,
+            "farmer": dict(farmer),
+            "farmer_record": farmer_record,
+            "findings": list(findings),
+            "store": store,
+            "seq": seq,
+        }
+        if store is not None:
+            with self._progress_lock:
+                progress = self._progress_for(store, seq)
+                if not progress["replayed"] and progress["liveFrom"] is None:
+                    progress["liveFrom"] = seq
+        if self.workers:
+            self.queue.put(event)
+        else:
+            try:
+                self.process(event)
+            finally:
+                self._checked(event)
+
+    def flush(self):
+        """Block until every queued event has been processed."""
+        self.queue.join()
+
+    def status(self, transaction_id):
+        """Return "pending", "clear" or the flagged case for a recent transaction."""
+        with self._results_lock:
+            if transaction_id not in self.results:
+                return "pending"
+            return self.results[transaction_id] or "clear"
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            try:
+                self.process(event)
+            except Exception:
+                log.exception("fraud check failed for %s",
+                              event["transaction"].get("transactionId"))
+            finally:
+                self._checked(event)
+                self.queue.task_done()
+
+    # ---- processed watermark ----
+
+    def _progress_for(self, store, default):
+        # caller holds _progress_lock
+        progress = self._progress.get(store.data_dir)
+        if progress is None:
+            checked = store.load("fraud_progress").get("checkedTransactions")
+            if checked is None:
+                # first run with a watermark: earlier sales count as checked
+                checked = default
+                store.put("fraud_progress", "checkedTransactions", checked)
+            progress = self._progress[store.data_dir] = {
+                "checked": checked, "done": set(), "replayed": False, "liveFrom": None,
+            }
+        return progress
+
+    def _checked(self, event):
+        store, seq = event.get("store"), event.get("seq")
+        if store is None or seq is None:
+            return
+        with self._progress_lock:
+            progress = self._progress_for(store, seq)
+            if seq < progress["checked"]:
+                return
+            done = progress["done"]
+            done.add(seq)
+            checked = progress["checked"]
+            while checked in done:
+                done.remove(checked)
+                checked += 1
+            if checked != progress["checked"]:
+                progress["checked"] = checked
+                store.put("fraud_progress", "checkedTransactions", checked)
+
+    def mark_checked(self, store, seq):
+        """Advance the watermark past a sale that will not be published."""
+        self._checked({"store": store, "seq": seq})
+
+    def unchecked(self, store):
+        """
+        Positions in store's transactions that were recorded but not checked
+        before the last shutdown (once per store; later calls return an empty
+        range). Call while holding the lock that serialises the store's sales.
+        """
+        total = len(store.records("transactions"))
+        with self._progress_lock:
+            progress = self._progress_for(store, total)
+            if progress["replayed"]:
+                return range(0)
+            progress["replayed"] = True
+            end = progress["liveFrom"] if progress["liveFrom"] is not None else total
+            return range(progress["checked"], end)
+
+    def _state_for(self, detector):
+        state = {}
+        for name in detector.requires:
+            if name == "entitlement_index":
+                state[name] = self.router.root.entitlement_index()
+            elif name == "flagged":
+                state["dealer_flag_counts"] = self.dealer_flag_counts()
+            else:
+                state[name] = self.router.root.load(name)
+        return state
+
+    def dealer_flag_counts(self):
+        """Flagged cases per dealer, kept up to date as cases are added."""
+        with self._results_lock:
+            if self._dealer_flag_counts is None:
+                counts = Counter()
+                for cases in self.router.fan_out(lambda s: s.load("flagged")).values():
+                    counts.update(case.get("dealerId") for case in cases)
+                self._dealer_flag_counts = counts
+            return self._dealer_flag_counts
+
+    def process(self, event):
+        findings = list(event["findings"])
+        for detector in self.detectors:
+            findings.extend(detector.inspect(event, self._state_for(detector)))
+
+        txn = event["transaction"]
+        case = None
+        if findings:
+            score = combine_scores(f["score"] for f in findings)
+            case = {
+                "caseId": f"CASE-{str(uuid4())[:8].upper()}",
+                "transactionId": txn.get("transactionId"),
+                "efn": txn.get("efn"),
+                "dealerId": txn.get("dealerId"),
+                "reason": " | ".join(f["reason"] for f in findings),
+                "severity": severity_for(score),
+                "riskScore": score,
+                "findings": findings,
+                "timestamp": datetime.now().isoformat(),
+            }
+            self.router.store_for(case["efn"], create=True).append("flagged", case)
+            self.dealer_flag_counts()
+
+        with self._results_lock:
+            if case:
+                self._dealer_flag_counts[case["dealerId"]] += 1
+            self.results[txn.get("transactionId")] = case
+            while len(self.results) > self.RESULT_CACHE_SIZE:
+                self.results.popitem(last=False)
+        if case and self.on_case:
+            self.on_case(case, event["farmer"])
+        return case
+
+
+def build_detectors(names=None):
+    """Instantiate registered detectors (all of them by default)."""
+    names = names or list(DETECTORS)
+    return [DETECTORS[n]() for n in names]
@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: the lock only covers this process there
+    fcntl = None
+
+
+# ---------- Idempotency key store (dealer sales) ----------
+#
+# Every dealer sale carries a client-generated idempotency key. The store keeps
+# an in-memory dict of seen keys (O(1) duplicate lookup) backed by an
+# append-only JSON-lines log. Expired keys are dropped when the log is compacted.
+#
+# Several processes may serve one data dir (multi-worker servers, rolling
+# restarts). `lock` is also an flock on <log>.lock, and every check re-reads
+# whatever other processes appended to the log since the last one, so a
+# retry that lands on another process is still seen. Without fcntl
+# (Windows) only one process may serve a data dir.
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600  # offline terminals may sync up to a week later
+
+
+class ProcessLock:
+    """Re-entrant lock held across threads and, via flock, across processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            if self._depth == 0 and fcntl is not None:
+                if self._fd is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+
+class IdempotencyStore:
+    def __init__(self, path, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        # held by callers around check + record so two retries of the same
+        # sale cannot both be recorded, in this process or another
+        self.lock = ProcessLock(path + ".lock")
+        self._keys = None
+        self._log_lines = 0
+        self._offset = 0    # bytes of the log read so far
+        self._stamp = None  # (inode, size, mtime) when last read
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _load(self):
+        self._keys = {}
+        self._log_lines = 0
+        self._offset = 0
+        self._stamp = None
+        self._read_tail()
+
+    def _read_tail(self):
+        """Apply log lines appended since the last read."""
+        stamp = self._file_stamp()
+        if stamp is None:
+            self._stamp = None
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # a torn final line is read once completed
+        self._offset += end
+        self._stamp = stamp
+        now = time.time()
+        for line in data[:end].decode("utf-8", "replace").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn write from a crash; ignore the line
+            self._log_lines += 1
+            if now - entry.get("seenAt", 0) < self.ttl_seconds:
+                self._keys[entry["key"]] = entry
+            else:
+                self._keys.pop(entry["key"], None)
+
+    def _ensure_loaded(self):
+        """Load the log, or catch up with what other processes wrote to it."""
+        if self._keys is None:
+            self._load()
+            return
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        if stamp is None or self._stamp is None or stamp[0] != self._stamp[0] \
+                or stamp[1] < self._offset:
+            self._load()  # replaced by another process's compact()
+        else:
+            self._read_tail()
+
+    def get(self, key):
+        """Return the stored entry for key, or None if unseen/expired."""
+        with self.lock:
+            self._ensure_loaded()
+            entry = self._keys.get(key)
+            if entry and time.time() - entry["seenAt"] >= self.ttl_seconds:
+                del self._keys[key]
+                return None
+            return entry
+
+    def remember(self, key, transaction_id, risk=None):
+        """Record key as used by transaction_id (append-only)."""
+        entry = {
+            "key": key,
+            "transactionId": transaction_id,
+            "risk": risk,
+            "seenAt": time.time(),
+        }
+        with self.lock:
+            self._ensure_loaded()
+            self._keys[key] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+                self._offset = f.tell()
+            self._stamp = self._file_stamp()
+            self._log_lines += 1
+            if self._log_lines > 2 * len(self._keys) + 1000:
+                self.compact()
+        return entry
+
+    def compact(self):
+        """Drop expired keys and rewrite the log with live entries only."""
+        with self.lock:
+            self._ensure_loaded()
+            now = time.time()
+            live = {
+                k: e for k, e in self._keys.items()
+                if now - e["seenAt"] < self.ttl_seconds
+            }
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                for entry in live.values():
+                    f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+                self._offset = f.tell()
+            os.replace(tmp, self.path)
+            self._stamp = self._file_stamp()
+            self._keys = live
+            self._log_lines = len(live)
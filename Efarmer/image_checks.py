@@ -0,0 +1,56 @@
+# ---------- Farmer photo checks -> imageStatus ----------
+#
+# Shared by the upload route and the archive re-verification job
+# (reverify_images.py), so both apply the same rules.
+
+IMAGE_SLOTS = (
+    # farmer field, imageChecks key / imageType, label
+    ("standardImage", "standard", "Standard"),
+    ("cornerImage", "corner", "Corner"),
+)
+
+
+def duplicate_reasons(earlier_usages, efn, image_type, label):
+    """
+    Why a photo counts as reused, given the usages recorded for the same
+    content before this one ([{"efn", "imageType"}], image_hashes order).
+    """
+    reasons = []
+    for entry in earlier_usages:
+        if entry["efn"] != efn:
+            reasons.append(f"{label} image reused from EFN {entry['efn']} ({entry['imageType']})")
+        elif entry["imageType"] != image_type:
+            reasons.append("Same image used for both standard and corner photos")
+    return reasons
+
+
+def decide_image_status(farmer):
+    """
+    Derive imageStatus from farmer["imageChecks"], which holds per photo slot
+    {"duplicates": [reasons], "gps": {"result": ..., "distanceM": ..., "takenAt": ...}}
+    and, after an archive re-check, "integrity": [reasons] for missing or
+    altered files.
+    """
+    checks = farmer.get("imageChecks", {})
+    reasons = []
+    gps_results = []
+    for _field, image_type, _label in IMAGE_SLOTS:
+        slot = checks.get(image_type, {})
+        reasons.extend(slot.get("integrity", []))
+        reasons.extend(slot.get("duplicates", []))
+        gps = slot.get("gps")
+        if gps:
+            gps_results.append(gps["result"])
+            if gps["result"] == "mismatch":
+                reasons.append(
+                    f"GPS mismatch: {image_type} photo taken "
+                    f"{gps['distanceM'] / 1000:.1f} km from registered plot"
+                )
+
+    if reasons:
+        return "Suspicious: " + " | ".join(reasons)
+    if not (farmer.get("standardImage") and farmer.get("cornerImage")):
+        return "Images Pending"
+    if gps_results and all(r == "match" for r in gps_results):
+        return "Verified (unique images, GPS matched)"
+    return "Verified (unique images, GPS not verified)"
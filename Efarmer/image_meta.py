@@ -0,0 +1,165 @@
+import math
+import struct
+from datetime import datetime
+
+
+# ---------- EXIF metadata (GPS + capture time) ----------
+#
+# Only the JPEG APP1/EXIF header is read; pixel data is never decoded, so
+# parsing costs a few KB of I/O per photo regardless of camera resolution.
+
+GPS_MATCH_RADIUS_M = 500  # photo must be taken within this distance of the plot
+EARTH_RADIUS_M = 6371000
+
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_DATETIME = 0x0132
+GPS_LAT_REF, GPS_LAT, GPS_LON_REF, GPS_LON = 1, 2, 3, 4
+
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+
+def _read_app1(f):
+    """Return the raw EXIF (TIFF) block of a JPEG file, or None."""
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        if marker[1] in (0xDA, 0xD9):  # start of scan / end: no EXIF before pixels
+            return None
+        length = struct.unpack(">H", f.read(2))[0]
+        segment = f.read(length - 2)
+        if marker[1] == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            return segment[6:]
+
+
+def _parse_ifd(tiff, offset, endian):
+    """Return {tag: value} for one IFD; rationals become floats."""
+    entries = {}
+    if offset + 2 > len(tiff):
+        return entries
+    count = struct.unpack(endian + "H", tiff[offset:offset + 2])[0]
+    for i in range(count):
+        pos = offset + 2 + i * 12
+        if pos + 12 > len(tiff):
+            break
+        tag, typ, n = struct.unpack(endian + "HHI", tiff[pos:pos + 8])
+        size = TYPE_SIZES.get(typ, 1) * n
+        if size <= 4:
+            data = tiff[pos + 8:pos + 8 + size]
+        else:
+            ptr = struct.unpack(endian + "I", tiff[pos + 8:pos + 12])[0]
+            data = tiff[ptr:ptr + size]
+        if len(data) < size:
+            continue
+
+        if typ == 2:
+            value = data.rstrip(b"\x00").decode("ascii", "replace")
+        elif typ == 3:
+            value = struct.unpack(endian + "H" * n, data)
+        elif typ in (4, 9):
+            value = struct.unpack(endian + ("I" if typ == 4 else "i") * n, data)
+        elif typ in (5, 10):
+            nums = struct.unpack(endian + ("I" if typ == 5 else "i") * (2 * n), data)
+            value = tuple(
+                nums[j] / nums[j + 1] if nums[j + 1] else 0.0
+                for j in range(0, len(nums), 2)
+            )
+        else:
+            value = data
+        if isinstance(value, tuple) and len(value) == 1:
+            value = value[0]
+        entries[tag] = value
+    return entries
+
+
+def _sub_ifd(tiff, ifd0, tag, endian):
+    """Parse the IFD an ifd0 pointer tag refers to; {} unless it is a valid offset."""
+    offset = ifd0.get(tag)
+    if not isinstance(offset, int) or not 8 <= offset < len(tiff):
+        return {}
+    return _parse_ifd(tiff, offset, endian)
+
+
+def _dms_to_degrees(dms, ref):
+    if not isinstance(dms, tuple) or len(dms) != 3:
+        return None
+    deg = dms[0] + dms[1] / 60 + dms[2] / 3600
+    return -deg if ref in ("S", "W") else deg
+
+
+def read_exif(path):
+    """
+    Extract {"lat", "lon", "takenAt"} from a photo's EXIF header.
+    Missing values are None; non-JPEG or metadata-free files give all None.
+    """
+    meta = {"lat": None, "lon": None, "takenAt": None}
+    try:
+        with open(path, "rb") as f:
+            tiff = _read_app1(f)
+    except (OSError, struct.error):
+        return meta
+    if not tiff or len(tiff) < 8:
+        return meta
+
+    endian = "<" if tiff[:2] == b"II" else ">"
+    try:
+        ifd0 = _parse_ifd(tiff, struct.unpack(endian + "I", tiff[4:8])[0], endian)
+        exif = _sub_ifd(tiff, ifd0, TAG_EXIF_IFD, endian)
+        taken = exif.get(TAG_DATETIME_ORIGINAL) or ifd0.get(TAG_DATETIME)
+        if isinstance(taken, str):
+            try:
+                meta["takenAt"] = datetime.strptime(taken, "%Y:%m:%d %H:%M:%S").isoformat()
+            except ValueError:
+                pass
+
+        gps = _sub_ifd(tiff, ifd0, TAG_GPS_IFD, endian)
+        if gps:
+            meta["lat"] = _dms_to_degrees(gps.get(GPS_LAT), gps.get(GPS_LAT_REF))
+            meta["lon"] = _dms_to_degrees(gps.get(GPS_LON), gps.get(GPS_LON_REF))
+    except (struct.error, TypeError, ValueError):
+        pass  # truncated / malformed EXIF; keep whatever was parsed
+    return meta
+
+
+# ---------- Plot location check ----------
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance in metres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def parse_plot_location(farmer):
+    """Registered (lat, lon) of the farmer's plot, or None if missing/invalid."""
+    try:
+        lat = float(farmer.get("landLat"))
+        lon = float(farmer.get("landLon"))
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def check_photo_location(farmer, meta, radius_m=GPS_MATCH_RADIUS_M):
+    """
+    Compare one photo's EXIF GPS with the registered plot.
+    Returns {"result": "match"|"mismatch"|"no_gps"|"no_plot", "distanceM": ...}.
+    """
+    plot = parse_plot_location(farmer)
+    if plot is None:
+        return {"result": "no_plot", "distanceM": None}
+    if not meta or meta.get("lat") is None or meta.get("lon") is None:
+        return {"result": "no_gps", "distanceM": None}
+    d = distance_m(plot[0], plot[1], meta["lat"], meta["lon"])
+    return {
+        "result": "match" if d <= radius_m else "mismatch",
+        "distanceM": round(d),
+    }
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import re
+import shutil
+from uuid import uuid4
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it only originals are served
+    Image = None
+
+
+# ---------- Content-addressed upload store ----------
+#
+# Uploads are stored once per distinct content:
+#   <root>/<h[:2]>/<h>/original.<ext>
+#   <root>/<h[:2]>/<h>/thumb.jpg     (admin tables)
+#   <root>/<h[:2]>/<h>/review.jpg    (admin review pages)
+# where h is the SHA256 of the original bytes. Renditions are made once at
+# ingest, so nothing is resized per request.
+
+MAX_UPLOAD_BYTES = 12 * 1024 * 1024
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+RENDITIONS = {"thumb": 256, "review": 1280}
+# a few KB of PNG can declare billions of pixels; refuse anything a phone
+# camera would not produce before decoding it
+MAX_IMAGE_PIXELS = 50_000_000
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageRejected(ValueError):
+    """Upload refused (too large, unsupported type or implausible dimensions)."""
+
+
+def is_digest(value):
+    return bool(value) and bool(DIGEST_RE.match(value))
+
+
+def hash_file(path):
+    """SHA256 of a file on disk, the same digest ingest() computes."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ImageStore:
+    def __init__(self, root, max_bytes=MAX_UPLOAD_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def object_dir(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.isdir(self.object_dir(digest))
+
+    def ingest(self, file_storage):
+        """
+        Store an uploaded file (werkzeug FileStorage). The file is hashed while
+        it is streamed to disk, so it is read exactly once.
+        Returns (digest, created) - created is False for duplicate content.
+        """
+        ext = os.path.splitext(file_storage.filename or "")[1].lower()
+        if ext not in ALLOWED_EXTENSIONS:
+            raise ImageRejected(f"Unsupported image type: {ext or 'unknown'}")
+
+        h = hashlib.sha256()
+        size = 0
+        tmp = os.path.join(self.root, f".incoming-{uuid4().hex}")
+        try:
+            with open(tmp, "wb") as out:
+                for chunk in iter(lambda: file_storage.stream.read(CHUNK_SIZE), b""):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ImageRejected(
+                            f"Image larger than {self.max_bytes // (1024 * 1024)} MB"
+                        )
+                    h.update(chunk)
+                    out.write(chunk)
+            if size == 0:
+                raise ImageRejected("Empty image upload")
+
+            digest = h.hexdigest()
+            obj_dir = self.object_dir(digest)
+            if os.path.isdir(obj_dir):
+                return digest, False
+
+            staging = obj_dir + f".staging-{uuid4().hex[:8]}"
+            os.makedirs(staging)
+            try:
+                shutil.move(tmp, os.path.join(staging, "original" + ext))
+                self._make_renditions(staging, ext)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            try:
+                os.rename(staging, obj_dir)
+            except OSError:
+                # same content ingested concurrently; keep the first copy
+                shutil.rmtree(staging, ignore_errors=True)
+                return digest, False
+            return digest, True
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _make_renditions(self, obj_dir, ext):
+        if Image is None:
+            return
+        try:
+            with Image.open(os.path.join(obj_dir, "original" + ext)) as img:
+                # only the header has been read so far
+                width, height = img.size
+                if width * height > MAX_IMAGE_PIXELS:
+                    raise ImageRejected(f"Image dimensions too large ({width}x{height})")
+                largest = max(RENDITIONS.values())
+                # JPEG: decode at the smallest 1/2..1/8 scale still >= the largest rendition
+                img.draft("RGB", (largest, largest))
+                img = ImageOps.exif_transpose(img)
+                if img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+                # largest first, each rendition shrunk from the previous one
+                for name, edge in sorted(RENDITIONS.items(), key=lambda r: -r[1]):
+                    img.thumbnail((edge, edge))
+                    img.save(os.path.join(obj_dir, name + ".jpg"),
+                             "JPEG", quality=80, optimize=True)
+        except Image.DecompressionBombError as e:
+            raise ImageRejected("Image dimensions too large") from e
+        except OSError:
+            pass  # undecodable image: the original is still kept and served
+
+    def original_path(self, digest):
+        obj_dir = self.object_dir(digest)
+        if not os.path.isdir(obj_dir):
+            return None
+        for name in os.listdir(obj_dir):
+            if name.startswith("original"):
+                return os.path.join(obj_dir, name)
+        return None
+
+    def path_for(self, digest, variant="original"):
+        """File to serve for a variant; falls back to the original."""
+        if not is_digest(digest):
+            return None
+        if variant in RENDITIONS:
+            path = os.path.join(self.object_dir(digest), variant + ".jpg")
+            if os.path.exists(path):
+                return path
+        return self.original_path(digest)
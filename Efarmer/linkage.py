@@ -0,0 +1,133 @@
+import math
+import re
+import threading
+from collections import Counter
+
+
+# ---------- Ghost-farmer linkage (incremental union-find) ----------
+#
+# Farmers that share an identifying attribute (phone, ration card, Aadhaar,
+# same name in the same village, or a reused photo) are joined into one
+# component. Union-find with path halving + union by size keeps every add
+# near O(1), so the whole registry is processed in near-linear time.
+
+LINK_WEIGHTS = {
+    "aadhaar": 3.0,      # must be unique per person
+    "image": 3.0,        # same land photo on two EFNs
+    "village_name": 2.0,
+    "phone": 1.0,        # shared family phones are common
+    "rationCard": 1.0,   # family members legitimately share a card
+}
+
+
+def _digits(value):
+    return re.sub(r"\D", "", value or "")
+
+
+def link_keys(farmer):
+    """Attribute keys a farmer can be linked on (empty values are skipped)."""
+    keys = []
+    phone = _digits(farmer.get("phone"))[-10:]
+    if phone:
+        keys.append(("phone", phone))
+    ration = (farmer.get("rationCard") or "").strip().upper()
+    if ration:
+        keys.append(("rationCard", ration))
+    aadhaar = _digits(farmer.get("aadhaar"))
+    if aadhaar:
+        keys.append(("aadhaar", aadhaar))
+    name = " ".join((farmer.get("farmerName") or "").lower().split())
+    village = " ".join((farmer.get("village") or "").lower().split())
+    if name and village:
+        keys.append(("village_name", f"{village}|{name}"))
+    return keys
+
+
+class LinkageEngine:
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+        self._members = {}  # root -> [efn, ...]
+        self._links = {}    # root -> Counter(link kind -> shared-attribute hits)
+        self._owner = {}    # (kind, value) -> first EFN seen with it
+        self._lock = threading.Lock()
+
+    def _add(self, efn):
+        if efn not in self._parent:
+            self._parent[efn] = efn
+            self._size[efn] = 1
+            self._members[efn] = [efn]
+            self._links[efn] = Counter()
+
+    def find(self, efn):
+        parent = self._parent
+        while parent[efn] != efn:
+            parent[efn] = parent[parent[efn]]  # path halving
+            efn = parent[efn]
+        return efn
+
+    def _union(self, a, b, kind):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            if self._size[ra] < self._size[rb]:
+                ra, rb = rb, ra
+            self._parent[rb] = ra
+            self._size[ra] += self._size.pop(rb)
+            self._members[ra].extend(self._members.pop(rb))
+            self._links[ra].update(self._links.pop(rb))
+        self._links[ra][kind] += 1
+
+    def _link(self, efn, key):
+        owner = self._owner.get(key)
+        if owner is None:
+            self._owner[key] = efn
+        elif owner != efn:
+            self._union(efn, owner, key[0])
+
+    def add_farmer(self, farmer):
+        with self._lock:
+            efn = farmer["efn"]
+            self._add(efn)
+            for key in link_keys(farmer):
+                self._link(efn, key)
+
+    def add_image(self, digest, efn):
+        with self._lock:
+            self._add(efn)
+            self._link(efn, ("image", digest))
+
+    def cluster_of(self, efn):
+        with self._lock:
+            if efn not in self._parent:
+                return [efn]
+            return list(self._members[self.find(efn)])
+
+    def clusters(self, min_size=2, limit=None):
+        """Components of at least min_size farmers, highest score first."""
+        with self._lock:
+            ranked = []
+            for root, members in self._members.items():
+                if len(members) < min_size:
+                    continue
+                links = self._links[root]
+                overlap = sum(LINK_WEIGHTS.get(k, 1.0) * n for k, n in links.items())
+                score = round(overlap * (1 + math.log2(len(members))), 2)
+                ranked.append({
+                    "score": score,
+                    "size": len(members),
+                    "efns": sorted(members),
+                    "sharedAttributes": dict(links),
+                })
+        ranked.sort(key=lambda c: (-c["score"], -c["size"]))
+        return ranked[:limit] if limit else ranked
+
+
+def build_linkage(farmers, image_hashes):
+    """Full rebuild from farmers.json + image_hashes.json."""
+    engine = LinkageEngine()
+    for farmer in farmers.values():
+        engine.add_farmer(farmer)
+    for digest, usages in image_hashes.items():
+        for usage in usages:
+            engine.add_image(digest, usage["efn"])
+    return engine
@@ -0,0 +1,182 @@
+import math
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum
+
+
+# ---------- Typed in-memory records ----------
+#
+# The JSON registries stay as they are on disk. In memory, the hot paths
+# (entitlement, fraud detectors, velocity, rollups, backtests) use these
+# slotted records: numbers are parsed once at ingest, quantities are
+# normalised to kg, and crop / zone / soil / product are enum members
+# instead of repeated strings. Registries are written by forms and dealer
+# terminals, so from_dict() coerces odd values (numbers where text is
+# expected, unparsable dates) instead of raising on them.
+
+class CodedEnum(Enum):
+    """Enum parsed case-insensitively from form values; unknown -> OTHER."""
+
+    @classmethod
+    def parse(cls, value):
+        lookup = _PARSE_CACHE.get(cls)
+        if lookup is None:
+            lookup = _PARSE_CACHE[cls] = {m.value.lower(): m for m in cls}
+        return lookup.get(_text(value).strip().lower(), cls.OTHER)
+
+
+_PARSE_CACHE = {}
+
+
+def _text(value):
+    """Registry value as a string; None / empty -> ""."""
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+
+class Crop(CodedEnum):
+    PADDY = "Paddy"
+    WHEAT = "Wheat"
+    COTTON = "Cotton"
+    MILLETS = "Millets"
+    OTHER = "Other"
+
+
+class Zone(CodedEnum):
+    HIGH = "High"
+    MEDIUM = "Medium"
+    LOW = "Low"
+    OTHER = "Other"
+
+
+class Soil(CodedEnum):
+    BLACK = "Black"
+    RED = "Red"
+    ALLUVIAL = "Alluvial"
+    LATERITE = "Laterite"
+    OTHER = "Other"
+
+
+class Product(CodedEnum):
+    UREA = "Urea"
+    DAP = "DAP"
+    SEEDS = "Seeds"
+    OTHER = "Other"
+
+
+# ---------- Quantities ----------
+
+# free-text units seen on dealer forms -> kg
+UNIT_TO_KG = {
+    "kg": 1.0,
+    "kgs": 1.0,
+    "g": 0.001,
+    "quintal": 100.0,
+    "q": 100.0,
+    "tonne": 1000.0,
+    "tonnes": 1000.0,
+    "t": 1000.0,
+    "bag": 50.0,   # standard fertilizer bag
+    "bags": 50.0,
+}
+
+
+def parse_quantity(value):
+    try:
+        number = float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    return number if math.isfinite(number) else 0.0
+
+
+def quantity_in_kg(quantity, unit):
+    """Normalise a quantity to kg; unknown units are taken as kg."""
+    factor = UNIT_TO_KG.get((_text(unit) or "kg").strip().lower(), 1.0)
+    return parse_quantity(quantity) * factor
+
+
+def txn_timestamp(txn):
+    """Sale time of a transaction (createdAt, else its date) as epoch seconds."""
+    for field, fmt in (("createdAt", None), ("date", "%Y-%m-%d")):
+        value = _text(txn.get(field))
+        if not value:
+            continue
+        try:
+            dt = datetime.fromisoformat(value) if fmt is None else datetime.strptime(value, fmt)
+            return dt.timestamp()
+        except (ValueError, OverflowError, OSError):
+            continue
+    return datetime.now().timestamp()
+
+
+def _coordinate(value, limit):
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return None
+    return v if -limit <= v <= limit else None
+
+
+# ---------- Records ----------
+
+@dataclass(slots=True, frozen=True)
+class FarmerRecord:
+    efn: str
+    district: str
+    crop: Crop
+    zone: Zone
+    soil: Soil
+    land_area: float
+    lat: float | None = None
+    lon: float | None = None
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            efn=_text(d.get("efn")),
+            district=(_text(d.get("district")).strip() or "unknown").lower(),
+            crop=Crop.parse(d.get("cropType")),
+            zone=Zone.parse(d.get("rainfallZone")),
+            soil=Soil.parse(d.get("soilType")),
+            land_area=parse_quantity(d.get("landArea")),
+            lat=_coordinate(d.get("landLat"), 90),
+            lon=_coordinate(d.get("landLon"), 180),
+        )
+
+    @classmethod
+    def unknown(cls, efn=""):
+        """Placeholder for sales whose EFN is not in the registry."""
+        return cls(efn, "unknown", Crop.OTHER, Zone.OTHER, Soil.OTHER, 0.0)
+
+
+@dataclass(slots=True, frozen=True)
+class TransactionRecord:
+    transaction_id: str
+    efn: str
+    dealer_id: str
+    product: Product
+    quantity_kg: float
+    ts: float      # sale time, epoch seconds
+    month: str     # "YYYY-MM" of the sale date
+
+    @classmethod
+    def from_dict(cls, d):
+        month = (_text(d.get("date")) or _text(d.get("createdAt")))[:7] or "unknown"
+        # EFN / dealer / month repeat across many sales: share one string each
+        return cls(
+            transaction_id=_text(d.get("transactionId")),
+            efn=sys.intern(_text(d.get("efn"))),
+            dealer_id=sys.intern(_text(d.get("dealerId"))),
+            product=Product.parse(d.get("productType")),
+            quantity_kg=quantity_in_kg(d.get("quantity"), d.get("unit")),
+            ts=txn_timestamp(d),
+            month=sys.intern(month),
+        )
+
+
+RECORD_TYPES = {
+    "farmers": FarmerRecord,
+    "transactions": TransactionRecord,
+}
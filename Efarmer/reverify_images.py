@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from image_checks import IMAGE_SLOTS, decide_image_status, duplicate_reasons
+from image_meta import check_photo_location, read_exif
+from image_store import ALLOWED_EXTENSIONS, hash_file, is_digest
+from shards import ShardRouter
+
+
+# ---------- Archive re-verification (batch job) ----------
+#
+# Re-hashes every photo under the upload folder (legacy <efn>_base/_corner
+# files and originals in the content-addressed object store) on a process
+# pool, then rebuilds image_hashes.json and re-derives every farmer's
+# imageChecks / imageStatus with the same rules the upload route uses.
+#
+# Finished files are appended to a JSON-lines checkpoint in the data dir,
+# so an interrupted run resumes without re-hashing them (a file whose size
+# or mtime changed is hashed again). The checkpoint is removed once the
+# registries are written.
+#
+# Run it while uploads are quiet: registries are rewritten at the end, and
+# a running app only picks up the new photo links (and re-scores the case
+# queue) after /admin/ghost-clusters?rebuild=1.
+
+BATCH_SIZE = 32          # files per worker task
+PROGRESS_EVERY = 2000    # files between progress lines / checkpoint fsyncs
+CHECKPOINT_FILE = "reverify_images.checkpoint"
+
+
+def archive_files(upload_root):
+    """Paths (relative to upload_root) of every photo in the archive."""
+    for dirpath, dirnames, filenames in os.walk(upload_root):
+        # skip in-flight ingests (.incoming-*, *.staging-*)
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".") and ".staging-" not in d)
+        rel_dir = os.path.relpath(dirpath, upload_root)
+        in_objects = rel_dir.split(os.sep)[0] == "objects"
+        for name in sorted(filenames):
+            if name.startswith(".") or os.path.splitext(name)[1].lower() not in ALLOWED_EXTENSIONS:
+                continue
+            if in_objects and not name.startswith("original"):
+                continue  # renditions are derived from the original
+            yield os.path.normpath(os.path.join(rel_dir, name))
+
+
+def hash_batch(upload_root, rel_paths):
+    """Worker: SHA256 + EXIF of a batch of files."""
+    results = []
+    for rel in rel_paths:
+        path = os.path.join(upload_root, rel)
+        try:
+            st = os.stat(path)
+            results.append({
+                "path": rel, "size": st.st_size, "mtime": st.st_mtime_ns,
+                "digest": hash_file(path), "meta": read_exif(path),
+            })
+        except Exception as e:  # one unreadable file must not fail the batch
+            results.append({"path": rel, "error": f"{type(e).__name__}: {e}"})
+    return results
+
+
+def load_checkpoint(path):
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn write from an interrupted run
+            done[entry["path"]] = entry
+    return done
+
+
+def _still_valid(entry, upload_root, rel):
+    if not entry or "error" in entry:
+        return False
+    try:
+        st = os.stat(os.path.join(upload_root, rel))
+    except OSError:
+        return False
+    return entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns
+
+
+def hash_archive(upload_root, checkpoint_path, workers=None, progress=sys.stderr):
+    """{rel path: hash entry} for every archive file, resuming from the checkpoint."""
+    files = list(archive_files(upload_root))
+    done = load_checkpoint(checkpoint_path)
+    pending = [rel for rel in files if not _still_valid(done.get(rel), upload_root, rel)]
+    stats = {"files": len(files), "resumed": len(files) - len(pending), "hashed": 0,
+             "bytes": 0, "errors": 0}
+
+    t0 = time.perf_counter()
+    if pending:
+        with open(checkpoint_path, "a", encoding="utf-8") as log, \
+                ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(hash_batch, upload_root, pending[i:i + BATCH_SIZE])
+                       for i in range(0, len(pending), BATCH_SIZE)]
+            reported = 0
+            for future in as_completed(futures):
+                for entry in future.result():
+                    done[entry["path"]] = entry
+                    log.write(json.dumps(entry) + "\n")
+                    stats["hashed"] += 1
+                    stats["bytes"] += entry.get("size", 0)
+                    stats["errors"] += "error" in entry
+                log.flush()
+                if stats["hashed"] - reported >= PROGRESS_EVERY:
+                    os.fsync(log.fileno())
+                    reported = stats["hashed"]
+                    elapsed = time.perf_counter() - t0
+                    print(f"reverify: {stats['hashed']}/{len(pending)} files hashed "
+                          f"({stats['hashed'] / elapsed:.0f} files/s, "
+                          f"{stats['bytes'] / elapsed / 1e6:.1f} MB/s)", file=progress)
+    stats["seconds"] = time.perf_counter() - t0
+    return {rel: done[rel] for rel in files if rel in done}, stats
+
+
+def apply_results(router, results):
+    """
+    Rebuild image_hashes from the verified archive and re-derive every
+    farmer's photo checks. Returns counts for the report.
+    """
+    root = router.root
+    objects, corrupt, archived = {}, set(), set()
+    for rel, entry in results.items():
+        if "error" in entry:
+            continue
+        parts = rel.split(os.sep)
+        if parts[0] != "objects":
+            archived.add(entry["digest"])  # legacy <efn>_<slot> file
+            continue
+        expected = parts[-2]  # objects/<h[:2]>/<h>/original.<ext>
+        archived.add(expected)
+        if entry["digest"] == expected:
+            objects[expected] = entry
+        else:
+            corrupt.add(expected)
+
+    # upload history (in upload order) is kept for all content still in the
+    # archive, legacy files included, so the first uploader stays the
+    # original and reuse of a photo a farmer has since replaced is still
+    # caught; usages found below are appended after it
+    image_hashes = {d: list(usages) for d, usages in root.load("image_hashes").items()
+                    if d in archived}
+
+    # pass 1: resolve every photo reference to its content and record usages
+    slots = {}  # (store code, efn) -> [(image_type, label, digest, meta, problem)]
+    missing = 0
+    stores = router.stores()
+    for code, store in stores.items():
+        for efn, farmer in store.load("farmers").items():
+            resolved = slots[(code, efn)] = []
+            for field, image_type, label in IMAGE_SLOTS:
+                ref = farmer.get(field)
+                if not ref:
+                    continue
+                if is_digest(ref):
+                    digest, entry = ref, objects.get(ref)
+                else:
+                    entry = results.get(os.path.normpath(ref))
+                    entry = None if entry is None or "error" in entry else entry
+                    digest = entry and entry["digest"]
+                problem = None
+                if digest in corrupt:
+                    problem = f"{label} photo does not match its stored hash"
+                elif entry is None:
+                    problem = f"{label} photo missing from archive"
+                    missing += 1
+                if digest:
+                    usages = image_hashes.setdefault(digest, [])
+                    usage = {"efn": efn, "imageType": image_type}
+                    if usage not in usages:
+                        usages.append(usage)
+                resolved.append((image_type, label, digest, entry and entry["meta"], problem))
+
+    # pass 2: duplicates against earlier usages, GPS against the plot
+    meta_cache = dict(root.load("image_meta"))
+    statuses = Counter()
+    changed = 0
+    for code, store in stores.items():
+        farmers = store.load("farmers")
+        touched = False
+        for efn, farmer in farmers.items():
+            checks = {}
+            for image_type, label, digest, meta, problem in slots.get((code, efn), ()):
+                usages = image_hashes.get(digest, [])
+                usage = {"efn": efn, "imageType": image_type}
+                earlier = usages[:usages.index(usage)] if usage in usages else usages
+                slot = {"duplicates": duplicate_reasons(earlier, efn, image_type, label)}
+                if problem:
+                    slot["integrity"] = [problem]
+                if meta and not problem:
+                    meta_cache[digest] = meta
+                    gps = check_photo_location(farmer, meta)
+                    gps["takenAt"] = meta.get("takenAt")
+                    slot["gps"] = gps
+                checks[image_type] = slot
+
+            before = (farmer.get("imageChecks"), farmer.get("imageStatus"))
+            if checks or "imageChecks" in farmer:
+                farmer["imageChecks"] = checks
+            farmer["imageStatus"] = decide_image_status(farmer)
+            statuses[farmer["imageStatus"].split(" (")[0].split(":")[0]] += 1
+            if (farmer.get("imageChecks"), farmer["imageStatus"]) != before:
+                touched = True
+                changed += 1
+        if touched:
+            store.save("farmers", farmers)
+
+    root.save("image_hashes", image_hashes)
+    root.save("image_meta", meta_cache)
+    return {
+        "farmers": len(slots),
+        "farmersChanged": changed,
+        "imageStatus": dict(statuses),
+        "contentHashes": len(image_hashes),
+        "sharedContent": sum(1 for u in image_hashes.values() if len({x["efn"] for x in u}) > 1),
+        "missingPhotos": missing,
+        "corruptObjects": len(corrupt),
+        "unreferencedObjects": len(set(objects) - set(image_hashes)),
+    }
+
+
+def reverify(data_dir, upload_root, workers=None, sharded=False, restart=False,
+             progress=sys.stderr):
+    t0 = time.perf_counter()
+    router = ShardRouter(data_dir, sharded=sharded)
+    checkpoint_path = os.path.join(data_dir, CHECKPOINT_FILE)
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    results, stats = hash_archive(upload_root, checkpoint_path, workers, progress)
+    t1 = time.perf_counter()
+    summary = apply_results(router, results)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)  # registries written: nothing left to resume
+
+    seconds = stats.pop("seconds")
+    summary.update(stats)
+    summary.update({
+        "workers": workers or os.cpu_count(),
+        "hashSeconds": round(seconds, 3),
+        "filesPerSecond": round(stats["hashed"] / seconds, 1) if seconds else None,
+        "mbPerSecond": round(stats["bytes"] / seconds / 1e6, 2) if seconds else None,
+        "applySeconds": round(time.perf_counter() - t1, 3),
+        "totalSeconds": round(time.perf_counter() - t0, 3),
+    })
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Re-hash the photo archive, rebuild image_hashes and every imageStatus."
+    )
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--uploads", default=os.path.join("static", "uploads"))
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: CPU count)")
+    parser.add_argument("--sharded", action="store_true", help="data dir uses district shards")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args(argv)
+    report = reverify(args.data_dir, args.uploads, args.workers, args.sharded, args.restart)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
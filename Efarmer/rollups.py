@@ -0,0 +1,142 @@
+import argparse
+import json
+import threading
+from collections import defaultdict
+
+from datastore import DataStore
+from models import FarmerRecord
+
+
+# ---------- Subsidy rollup cube: district x crop x product x month ----------
+#
+# One cell per (district, cropType, productType, month) holding the number of
+# sales and the quantity issued in kg (see models.UNIT_TO_KG). Cells are updated as each sale is
+# recorded, so dashboard queries only sum a few hundred cells instead of
+# joining transactions.json with farmers.json.
+
+DIMENSIONS = ("district", "cropType", "productType", "month")
+
+def cell_key(record, farmer):
+    return (farmer.district, farmer.crop.value, record.product.value, record.month)
+
+
+def normalise_filter(dimension, value):
+    """Filter value as stored in cells: districts as FarmerRecord keeps them."""
+    if dimension == "district":
+        return (str(value).strip() or "unknown").lower()
+    return value
+
+
+SAVE_EVERY = 200  # recorded sales between snapshots of the cube
+
+
+class RollupCube:
+    def __init__(self):
+        self._cells = defaultdict(lambda: [0, 0.0])  # key -> [count, qty_kg]
+        self._lock = threading.Lock()
+        self.covered = 0  # number of transactions (in file order) folded in
+
+    def __len__(self):
+        return len(self._cells)
+
+    def add(self, record, farmer):
+        """Fold in one TransactionRecord (farmer: its FarmerRecord)."""
+        key = cell_key(record, farmer)
+        with self._lock:
+            cell = self._cells[key]
+            cell[0] += 1
+            cell[1] += record.quantity_kg
+            self.covered += 1
+
+    def query(self, filters=None, group_by=("district",)):
+        """
+        Sum cells matching filters ({dimension: value}) grouped by the given
+        dimensions, e.g. query({"district": "raipur"}, ("productType", "month")).
+        """
+        return query_cubes([self], filters, group_by)
+
+    def _fold(self, positions, group_pos, groups):
+        with self._lock:
+            for key, (count, qty) in self._cells.items():
+                if all(key[i] == v for i, v in positions):
+                    g = groups[tuple(key[i] for i in group_pos)]
+                    g[0] += count
+                    g[1] += qty
+
+    def to_rows(self):
+        with self._lock:
+            return [list(k) + [c, round(q, 3)] for k, (c, q) in self._cells.items()]
+
+    @classmethod
+    def from_rows(cls, rows, covered):
+        cube = cls()
+        for *key, count, qty in rows:
+            cube._cells[tuple(key)] = [count, qty]
+        cube.covered = covered
+        return cube
+
+
+def query_cubes(cubes, filters=None, group_by=("district",)):
+    """RollupCube.query summed over several cubes (one per district shard)."""
+    filters = filters or {}
+    unknown = [d for d in list(filters) + list(group_by) if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown dimension(s): {', '.join(unknown)}")
+    positions = [(DIMENSIONS.index(d), normalise_filter(d, v)) for d, v in filters.items()]
+    group_pos = [DIMENSIONS.index(d) for d in group_by]
+
+    groups = defaultdict(lambda: [0, 0.0])
+    for cube in cubes:
+        cube._fold(positions, group_pos, groups)
+    rows = [
+        dict(zip(group_by, gk), transactions=c, quantityKg=round(q, 2))
+        for gk, (c, q) in groups.items()
+    ]
+    rows.sort(key=lambda r: -r["quantityKg"])
+    return rows
+
+
+def load_rollups(store):
+    """
+    Load the saved cube and fold in only the sales recorded after it was
+    saved; falls back to a full rebuild if there is no usable snapshot.
+    """
+    saved = store.load("rollups")
+    transactions = store.records("transactions")
+    farmers = store.records("farmers")
+    covered = saved.get("transactions")
+    if saved.get("cells") is not None and covered is not None and covered <= len(transactions):
+        cube = RollupCube.from_rows(saved["cells"], covered)
+    else:
+        cube = RollupCube()
+    for record in transactions[cube.covered:]:
+        cube.add(record, farmers.get(record.efn) or FarmerRecord.unknown(record.efn))
+    return cube
+
+
+def save_rollups(store, cube):
+    store.save("rollups", {"transactions": cube.covered, "cells": cube.to_rows()})
+
+
+def build_rollups(transactions, farmers):
+    """Full rebuild from TransactionRecords + {efn: FarmerRecord}."""
+    cube = RollupCube()
+    for record in transactions:
+        cube.add(record, farmers.get(record.efn) or FarmerRecord.unknown(record.efn))
+    return cube
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the subsidy rollup cube.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--data-dir", default="data")
+    args = parser.parse_args(argv)
+
+    store = DataStore(args.data_dir)
+    cube = build_rollups(store.records("transactions"), store.records("farmers"))
+    save_rollups(store, cube)
+    print(json.dumps({"cells": len(cube), "transactions": cube.covered}))
+
+
+if __name__ == "__main__":
+    main()
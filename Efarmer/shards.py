@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+from datastore import REGISTRIES, DataStore
+
+
+# ---------- District shards routed by EFN prefix ----------
+#
+# An EFN carries its district code (EFN-RAI-1A2B3C4D), so every
+# farmer-scoped registry can be split by that code: each district gets its
+# own DataStore under <data dir>/shards/<CODE>/ with its own files, caches
+# and locks. Idempotency keys are per shard too (store.idempotency), since a
+# sale always routes to its farmer's shard. Shared registries (dealers,
+# rules, photo hashes) stay in the root data dir. With sharding off the
+# router hands out the root store for everything, i.e. the original
+# single-store layout.
+#
+# A shard directory is a self-contained data dir, so a busy district can
+# also be served by its own process (DATA_DIR=data/shards/RAI) behind a
+# proxy that routes on the EFN prefix.
+
+SHARDED_REGISTRIES = ("farmers", "transactions", "flagged", "rollups", "fraud_progress")
+
+DEFAULT_SHARD = "IND"  # farmers registered without a district
+
+
+def district_code(district):
+    """Three-letter shard code used in EFNs issued for a district."""
+    return (district or DEFAULT_SHARD).strip().upper()[:3] or DEFAULT_SHARD
+
+
+def shard_code(efn):
+    """District code of an EFN ("EFN-RAI-..." -> "RAI"), else DEFAULT_SHARD."""
+    parts = (efn or "").split("-")
+    if len(parts) >= 3 and parts[0].upper() == "EFN" and parts[1]:
+        return parts[1].upper()
+    return DEFAULT_SHARD
+
+
+class ShardRouter:
+    def __init__(self, data_dir, sharded=False, max_workers=8):
+        self.data_dir = data_dir
+        self.root = DataStore(data_dir)
+        self.sharded = sharded
+        self._shards = {}  # code -> DataStore
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix="shard-fanout")
+        if sharded:
+            shards_dir = os.path.join(data_dir, "shards")
+            if os.path.isdir(shards_dir):
+                for code in sorted(os.listdir(shards_dir)):
+                    if os.path.isdir(os.path.join(shards_dir, code)):
+                        self.shard(code)
+
+    def shard(self, code, create=True):
+        """DataStore of one district shard; None if it does not exist and not create."""
+        if not self.sharded:
+            return self.root
+        with self._lock:
+            store = self._shards.get(code)
+            if store is None and create:
+                store = self._shards[code] = DataStore(
+                    os.path.join(self.data_dir, "shards", code)
+                )
+            return store
+
+    def store_for(self, efn, create=False):
+        """
+        Store holding a farmer's registration, sales and flagged cases.
+        Lookups of unknown districts return None rather than creating a shard.
+        """
+        return self.shard(shard_code(efn), create)
+
+    def farmer(self, efn):
+        """Farmer dict for an EFN, or None."""
+        store = self.store_for(efn)
+        return store.load("farmers").get(efn) if store else None
+
+    def stores(self):
+        """{code: store} for every shard ({"": root} when unsharded)."""
+        if not self.sharded:
+            return {"": self.root}
+        with self._lock:
+            return dict(sorted(self._shards.items()))
+
+    def run_each(self, fn, items):
+        """fn(item) for each {code: item} in parallel; returns {code: result}."""
+        futures = {code: self._pool.submit(fn, item) for code, item in items.items()}
+        return {code: f.result() for code, f in futures.items()}
+
+    def fan_out(self, fn):
+        """
+        Run fn(store) on every shard in parallel; returns {code: result}.
+        Each shard has its own store lock, so shards do not wait on each other.
+        """
+        return self.run_each(fn, self.stores())
+
+    # ---- merged views for cross-district (admin) queries ----
+
+    def farmers(self):
+        """{efn: farmer} across all shards."""
+        merged = {}
+        for part in self.fan_out(lambda s: s.load("farmers")).values():
+            merged.update(part)
+        return merged
+
+    def records(self, name):
+        """Typed records of a sharded registry, all shards concatenated."""
+        parts = self.fan_out(lambda s: s.records(name)).values()
+        if name == "farmers":
+            merged = {}
+            for part in parts:
+                merged.update(part)
+            return merged
+        return [r for part in parts for r in part]
+
+    def warm(self):
+        """Warm the root store and every shard; returns per-step seconds."""
+        if not self.sharded:
+            return self.root.warm()
+        shared = [n for n in REGISTRIES if n not in SHARDED_REGISTRIES]
+        timings = self.root.warm(shared)
+        for code, shard_timings in self.fan_out(lambda s: s.warm(SHARDED_REGISTRIES)).items():
+            for step, seconds in shard_timings.items():
+                timings[f"{code}:{step}"] = seconds
+        return timings
+
+
+def split_data_dir(data_dir):
+    """
+    Copy the farmer-scoped registries and idempotency keys of a
+    single-store data dir into per-district shards. The root files are left
+    in place (unused once SHARDING is on); rollups are rebuilt per shard on
+    first load.
+    """
+    root = DataStore(data_dir)
+    farmers = root.load("farmers")
+    parts = defaultdict(lambda: {"farmers": {}, "transactions": [], "flagged": []})
+    for efn, farmer in farmers.items():
+        parts[shard_code(efn)]["farmers"][efn] = farmer
+    for name in ("transactions", "flagged"):
+        for item in root.load(name):
+            parts[shard_code(item.get("efn"))][name].append(item)
+    # fraud-check watermark: a shard's checked sales are those below the root's
+    checked = root.load("fraud_progress").get("checkedTransactions")
+    if checked is not None:
+        for part in parts.values():
+            part["fraud_progress"] = {"checkedTransactions": 0}
+        for item in root.load("transactions")[:checked]:
+            parts[shard_code(item.get("efn"))]["fraud_progress"]["checkedTransactions"] += 1
+
+    # idempotency keys follow their sale, so a retry sent before the split
+    # is still answered as a duplicate by the farmer's shard
+    txn_shards = {t.get("transactionId"): shard_code(t.get("efn"))
+                  for t in root.load("transactions")}
+    key_lines = defaultdict(list)
+    if os.path.exists(root.idempotency.path):
+        with open(root.idempotency.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn write from a crash
+                code = txn_shards.get(entry.get("transactionId"))
+                # a key whose sale is unknown is kept by every shard
+                for c in [code] if code else list(parts):
+                    key_lines[c].append(line if line.endswith("\n") else line + "\n")
+
+    router = ShardRouter(data_dir, sharded=True)
+    summary = {}
+    for code, registries in sorted(parts.items()):
+        store = router.shard(code)
+        for name, data in registries.items():
+            storage.save_json(store.path(name), data)
+        with open(store.idempotency.path, "w", encoding="utf-8") as f:
+            f.writelines(key_lines[code])
+        summary[code] = {name: len(data) for name, data in registries.items()
+                         if name != "fraud_progress"}
+        summary[code]["idempotencyKeys"] = len(key_lines[code])
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split a data dir into district shards.")
+    parser.add_argument("command", choices=["split"])
+    parser.add_argument("--data-dir", default="data")
+    args = parser.parse_args(argv)
+    print(json.dumps(split_data_dir(args.data_dir), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+import threading
+
+
+# ---------- Registry persistence: snapshot + delta files ----------
+#
+# Each registry (farmers.json, transactions.json, ...) is stored as
+#   <name>.json        full snapshot in one of FORMATS
+#   <name>.json.delta  JSON-lines of changes since the snapshot
+# Loading reads the snapshot and replays the deltas. Small writes only append
+# to the delta file. Once the delta reaches SNAPSHOT_DELTA_RATIO of the
+# snapshot's size (at least SNAPSHOT_MIN_DELTA_BYTES) it is folded into a
+# fresh snapshot on a background thread: the delta is renamed to
+# <name>.json.delta.compacting, so writers carry on with a new delta while
+# the snapshot is rebuilt. Folding costs O(size) once per ~50% growth, i.e.
+# amortised O(1) per write, and no request waits for it.
+#
+# Each registry path has its own lock, so writes to different registries
+# (or different district shards) never wait on each other.
+
+FORMATS = ("json", "compact", "compact+gzip")
+GZIP_MAGIC = b"\x1f\x8b"
+
+STORAGE_FORMAT = os.environ.get("EFARMER_STORAGE_FORMAT", "compact")
+SNAPSHOT_MIN_DELTA_BYTES = 256 * 1024
+SNAPSHOT_DELTA_RATIO = 0.5
+
+log = logging.getLogger(__name__)
+
+_locks = {}        # path -> RLock
+_locks_guard = threading.Lock()
+_known = {}        # path -> (file stamps after our last write, write version)
+_generation = {}   # path -> bumped by save_json; older compactions are discarded
+_compacting = set()
+
+
+def _path_lock(path):
+    with _locks_guard:
+        lock = _locks.get(path)
+        if lock is None:
+            lock = _locks[path] = threading.RLock()
+        return lock
+
+
+def delta_path(path):
+    return path + ".delta"
+
+
+def compacting_path(path):
+    return path + ".delta.compacting"
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size, st.st_ino
+    except OSError:
+        return None
+
+
+def _files(path):
+    return _file_stamp(path), _file_stamp(compacting_path(path)), _file_stamp(delta_path(path))
+
+
+def stamp(path):
+    """
+    Change token for a registry. It changes on every write (this process's
+    or another's) but not when this process folds deltas into a snapshot,
+    so cached copies survive background compaction.
+    """
+    with _path_lock(path):
+        files = _files(path)
+        known = _known.get(path)
+        if known and known[0] == files:
+            return "v", known[1]
+        return "f", files
+
+
+def _wrote(path):
+    known = _known.get(path)
+    _known[path] = (_files(path), (known[1] if known else 0) + 1)
+
+
+def _moved(path, before):
+    # files rearranged without changing content; only vouch for them if
+    # nobody else changed them since our last write
+    known = _known.get(path)
+    if known and known[0] == before:
+        _known[path] = (_files(path), known[1])
+
+
+def encode(data, fmt):
+    """Serialize data to bytes in the given format."""
+    if fmt == "json":
+        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    raw = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if fmt == "compact":
+        return raw
+    if fmt == "compact+gzip":
+        return gzip.compress(raw, compresslevel=6)
+    raise ValueError(f"Unknown storage format: {fmt}")
+
+
+def decode(blob):
+    """Inverse of encode(); the format is detected from the bytes."""
+    if blob.startswith(GZIP_MAGIC):
+        blob = gzip.decompress(blob)
+    return json.loads(blob.decode("utf-8"))
+
+
+def _apply(data, change):
+    op = change.get("op")
+    if op == "append":
+        data.append(change["value"])
+    elif op == "set":
+        data[change["key"]] = change["value"]
+    return data
+
+
+def _read_snapshot(path, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, "rb") as f:
+            return decode(f.read())
+    except (json.JSONDecodeError, UnicodeDecodeError, OSError, EOFError):
+        return default
+
+
+def _read_changes(path):
+    changes = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    changes.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # torn final line after a crash
+    return changes
+
+
+def _replay_compacting(data, path):
+    changes = _read_changes(compacting_path(path))
+    if changes and changes[-1].get("op") == "folded" \
+            and changes[-1]["snapshot"] == list(_file_stamp(path) or ()):
+        # crashed after the new snapshot was in place: already included
+        return data
+    for change in changes:
+        data = _apply(data, change)
+    return data
+
+
+def load_json(path, default):
+    with _path_lock(path):
+        data = _replay_compacting(_read_snapshot(path, default), path)
+        for change in _read_changes(delta_path(path)):
+            data = _apply(data, change)
+        return data
+
+
+def _write_snapshot(path, data, fmt, tmp):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.write(encode(data, fmt))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def save_json(path, data, fmt=None):
+    """Write a full snapshot (atomically) and drop the delta files."""
+    fmt = fmt or STORAGE_FORMAT
+    with _path_lock(path):
+        tmp = path + ".tmp"
+        _write_snapshot(path, data, fmt, tmp)
+        os.replace(tmp, path)
+        # the snapshot now contains every delta, so they must not be replayed
+        for p in (compacting_path(path), delta_path(path)):
+            if os.path.exists(p):
+                os.remove(p)
+        _generation[path] = _generation.get(path, 0) + 1
+        _wrote(path)
+
+
+def _append_delta(path, change, default):
+    with _path_lock(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(delta_path(path), "a", encoding="utf-8") as f:
+            f.write(json.dumps(change, separators=(",", ":"), ensure_ascii=False) + "\n")
+            delta_bytes = f.tell()
+        _wrote(path)
+        snapshot = _file_stamp(path)
+        threshold = max(SNAPSHOT_MIN_DELTA_BYTES,
+                        SNAPSHOT_DELTA_RATIO * (snapshot[1] if snapshot else 0))
+        if delta_bytes >= threshold:
+            _schedule_compaction(path, default)
+
+
+def _schedule_compaction(path, default):
+    with _locks_guard:
+        if path in _compacting:
+            return
+        _compacting.add(path)
+    threading.Thread(target=_compact, args=(path, default),
+                     name="storage-compact", daemon=True).start()
+
+
+def _compact(path, default):
+    """Fold the delta log into a new snapshot; writers only wait for the renames."""
+    lock = _path_lock(path)
+    cpath = compacting_path(path)
+    tmp = path + ".compact.tmp"
+    try:
+        with lock:
+            generation = _generation.get(path, 0)
+            # a leftover .compacting file (crashed run) is folded first
+            if not os.path.exists(cpath) and os.path.exists(delta_path(path)):
+                before = _files(path)
+                os.replace(delta_path(path), cpath)
+                _moved(path, before)
+        if not os.path.exists(cpath):
+            return
+
+        # the slow part runs unlocked: nobody writes to the .compacting file
+        data = _replay_compacting(_read_snapshot(path, default), path)
+        _write_snapshot(path, data, STORAGE_FORMAT, tmp)
+
+        with lock:
+            if _generation.get(path, 0) != generation:
+                return  # a full save_json replaced everything meanwhile
+            before = _files(path)
+            # marker first: if we crash after the replace below, loading sees
+            # that the new snapshot already contains these changes
+            marker = {"op": "folded", "snapshot": list(_file_stamp(tmp))}
+            with open(cpath, "a", encoding="utf-8") as f:
+                f.write(json.dumps(marker) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            os.remove(cpath)
+            _moved(path, before)
+    except OSError:
+        log.exception("compacting %s failed; deltas are kept", path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        with _locks_guard:
+            _compacting.discard(path)
+
+
+def append_record(path, value):
+    """Append one item to a list registry (e.g. transactions)."""
+    _append_delta(path, {"op": "append", "value": value}, [])
+
+
+def put_record(path, key, value):
+    """Insert or replace one entry of a dict registry (e.g. farmers)."""
+    _append_delta(path, {"op": "set", "key": key, "value": value}, {})
+
+
+# ---------- CLI: convert existing registry files ----------
+
+def convert(path, fmt):
+    """Rewrite path (snapshot + deltas) as a single snapshot in fmt."""
+    if not os.path.exists(path) and not os.path.exists(delta_path(path)):
+        raise FileNotFoundError(path)
+    before = os.path.getsize(path) if os.path.exists(path) else 0
+    data = load_json(path, None)
+    if data is None:
+        raise ValueError(f"{path} could not be decoded")
+    save_json(path, data, fmt=fmt)
+    return before, os.path.getsize(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert E-Farmer registry files between storage formats."
+    )
+    parser.add_argument("files", nargs="+", help="registry files, e.g. data/farmers.json")
+    parser.add_argument("--format", choices=FORMATS, default="compact",
+                        help="target format (use 'json' to get readable files back)")
+    args = parser.parse_args(argv)
+
+    for path in args.files:
+        before, after = convert(path, args.format)
+        print(f"{path}: {before} -> {after} bytes ({args.format})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import bisect
+import threading
+from collections import Counter, deque
+from datetime import datetime
+
+
+# ---------- Sliding-window velocity checks per EFN ----------
+#
+# For every EFN and every configured window we keep a deque of recent sales
+# (oldest first) plus running totals: number of sales, quantity in kg, and sales
+# per dealer. A new sale is appended and entries that fell out of the window
+# are popped from the left, so each sale is added and expired exactly once.
+
+DEFAULT_WINDOWS = {
+    # name: seconds + limits (None = not checked)
+    "1h": {"seconds": 3600, "maxCount": 2, "maxDealers": 1, "maxQuantity": None},
+    "1d": {"seconds": 86400, "maxCount": 3, "maxDealers": 2, "maxQuantity": None},
+    "30d": {"seconds": 30 * 86400, "maxCount": 10, "maxDealers": 3, "maxQuantity": None},
+}
+
+SWEEP_EVERY = 5000  # observations between sweeps of idle EFNs
+
+
+class _Window:
+    __slots__ = ("entries", "quantity", "dealers")
+
+    def __init__(self):
+        self.entries = deque()  # (ts, quantity, dealer_id), sorted by ts
+        self.quantity = 0.0
+        self.dealers = Counter()
+
+    def add(self, ts, quantity, dealer_id):
+        entry = (ts, quantity, dealer_id)
+        if self.entries and ts < self.entries[-1][0]:
+            # late offline upload: keep the deque time-ordered
+            self.entries.insert(bisect.bisect(self.entries, ts, key=lambda e: e[0]), entry)
+        else:
+            self.entries.append(entry)
+        self.quantity += quantity
+        self.dealers[dealer_id] += 1
+
+    def expire(self, cutoff):
+        entries = self.entries
+        while entries and entries[0][0] < cutoff:
+            _ts, quantity, dealer_id = entries.popleft()
+            self.quantity -= quantity
+            self.dealers[dealer_id] -= 1
+            if not self.dealers[dealer_id]:
+                del self.dealers[dealer_id]
+
+
+class VelocityIndex:
+    def __init__(self, windows=None):
+        self.windows = windows or DEFAULT_WINDOWS
+        self.longest = max(w["seconds"] for w in self.windows.values())
+        self._by_efn = {}  # efn -> {window name: _Window}
+        self._newest = {}  # efn -> latest sale ts
+        self._lock = threading.Lock()
+        self._since_sweep = 0
+
+    def __len__(self):
+        return len(self._by_efn)
+
+    def observe(self, efn, ts, quantity, dealer_id):
+        """Add one sale and return the window limits it breaks."""
+        with self._lock:
+            windows = self._by_efn.get(efn)
+            if windows is None:
+                windows = self._by_efn[efn] = {name: _Window() for name in self.windows}
+            newest = max(ts, self._newest.get(efn, ts))
+            self._newest[efn] = newest
+
+            violations = []
+            for name, cfg in self.windows.items():
+                if ts < newest - cfg["seconds"]:
+                    continue  # sale is older than this window
+                w = windows[name]
+                w.add(ts, quantity, dealer_id)
+                w.expire(newest - cfg["seconds"])
+                violations.extend(self._check(name, cfg, w))
+
+            self._since_sweep += 1
+            if self._since_sweep >= SWEEP_EVERY:
+                self._sweep(newest)
+            return violations
+
+    def _check(self, name, cfg, w):
+        found = []
+        count = len(w.entries)
+        if cfg.get("maxCount") is not None and count > cfg["maxCount"]:
+            found.append({"window": name, "metric": "count", "value": count,
+                          "limit": cfg["maxCount"]})
+        if cfg.get("maxDealers") is not None and len(w.dealers) > cfg["maxDealers"]:
+            found.append({"window": name, "metric": "dealers", "value": len(w.dealers),
+                          "limit": cfg["maxDealers"], "dealerIds": sorted(w.dealers, key=str)})
+        if cfg.get("maxQuantity") is not None and w.quantity > cfg["maxQuantity"]:
+            found.append({"window": name, "metric": "quantity", "value": round(w.quantity, 2),
+                          "limit": cfg["maxQuantity"]})
+        return found
+
+    def _sweep(self, now):
+        """Forget EFNs with no sale inside the longest window."""
+        cutoff = now - self.longest
+        for efn in [e for e, ts in self._newest.items() if ts < cutoff]:
+            del self._newest[efn]
+            del self._by_efn[efn]
+        self._since_sweep = 0
+
+    def stats(self, efn):
+        """Current count / quantity / dealers per window for one EFN."""
+        with self._lock:
+            windows = self._by_efn.get(efn, {})
+            return {
+                name: {"count": len(w.entries), "quantity": round(w.quantity, 2),
+                       "dealers": sorted(w.dealers, key=str)}
+                for name, w in windows.items()
+            }
+
+
+def describe_violation(v):
+    if v["metric"] == "dealers":
+        return (f"Bought from {v['value']} dealers within {v['window']} "
+                f"({', '.join(str(d) for d in v['dealerIds'])})")
+    if v["metric"] == "count":
+        return f"{v['value']} purchases within {v['window']} (limit {v['limit']})"
+    return f"{v['value']} kg within {v['window']} (limit {v['limit']} kg)"
+
+
+VIOLATION_SCORES = {"dealers": 70, "count": 50, "quantity": 50}
+
+
+def build_velocity_index(records, windows=None, now=None):
+    """Seed an index from TransactionRecords; only sales inside the longest window matter."""
+    index = VelocityIndex(windows)
+    now = now or datetime.now().timestamp()
+    cutoff = now - index.longest
+    recent = sorted((r for r in records if r.ts >= cutoff), key=lambda r: r.ts)
+    for r in recent:
+        index.observe(r.efn, r.ts, r.quantity_kg, r.dealer_id)
+    return index